@@ -0,0 +1,50 @@
+"""
+Helpers shared by the benchmarks
+"""
+
+import numpy as np
+
+from planets import Planets
+
+
+G = 6.67408e-11
+
+# floating point operations per pair interaction
+# (3 sub, 3 mul + 2 add for r^2, sqrt, div, 3 mul for 1/r^3 and m, 3 mul + 3 add)
+# the usual convention for n-body codes
+FLOPS_PER_INTERACTION = 20
+
+DELTA_T = 27373870
+
+
+def make_planets(n: int, seed: int = 1337) -> Planets:
+    """
+    Random planets around a black hole, always the same for the same seed
+    (like the 'random' mode of the simulation, without initial speeds)
+
+    >>> make_planets(3).pos.shape
+    (3, 3)
+    >>> bool(np.all(make_planets(100).pos == make_planets(100).pos))
+    True
+    """
+    rng = np.random.RandomState(seed)
+    planets = Planets(n)
+    planets.pos[:] = rng.uniform(-1, 1, (n, 3)) * rng.uniform(5.8e10, 4.495e12, (n, 1))
+    planets.speeds[:] = rng.uniform(-1, 1, (n, 3)) * 1e3
+    planets.accels[:] = 0.0
+    planets.masses[:] = rng.uniform(5e20, 5e23, (n, 1))
+    planets.radii[:] = 1.0
+
+    # black hole
+    planets.pos[0] = 0.0
+    planets.speeds[0] = 0.0
+    planets.masses[0] = 1.99e30
+    return planets
+
+
+def step(worker, planets: Planets, new_planets: Planets, delta_t=DELTA_T):
+    """
+    One step of the given update implementation
+    """
+    worker.move_planets(planets.pos, planets.speeds, planets.accels, planets.masses,
+                        new_planets.pos, new_planets.speeds, new_planets.accels, planets.n, delta_t)
@@ -0,0 +1,52 @@
+"""
+GFLOP/s of the all-pairs update implementations
+
+usage: python3 -m bench.gflops [n] [impl ...]
+"""
+
+import time
+from importlib import import_module
+from sys import argv
+
+from bench.common import make_planets, step, FLOPS_PER_INTERACTION
+from lib.helper import get_log_func
+
+
+log = get_log_func("[gflops]")
+
+IMPLS = ["cyworker_parallel", "cyworker_symmetric", "cyworker_tiled"]
+REPEAT = 5
+
+
+def measure(impl, n):
+    """
+    :return: best time of one step in seconds, GFLOP/s (n^2 interactions)
+    """
+    worker = import_module("native." + impl)
+    planets = make_planets(n)
+    new_planets = planets.__copy__()
+
+    # warm up
+    step(worker, planets, new_planets)
+
+    best = float("inf")
+    for _ in range(REPEAT):
+        t_start = time.perf_counter()
+        step(worker, planets, new_planets)
+        best = min(best, time.perf_counter() - t_start)
+
+    return best, n * n * FLOPS_PER_INTERACTION / best / 1e9
+
+
+def main():
+    n = int(argv[1]) if len(argv) > 1 else 5000
+    impls = argv[2:] if len(argv) > 2 else IMPLS
+
+    log(f"n = {n}, {FLOPS_PER_INTERACTION} flops per interaction")
+    for impl in impls:
+        t, gflops = measure(impl, n)
+        log(f"  {impl:20s} {t * 1000:9.1f}ms  {gflops:7.2f} GFLOP/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+Step time of every update implementation over body counts and thread counts
+
+Every (implementation, threads) pair runs in its own python process with
+OMP_NUM_THREADS set (the OpenMP runtime reads it only once), on the same
+fixed seed planets (bench.common.make_planets).
+
+Reports median / p95 step time, pair interactions per second (n * (n - 1),
+for the tree codes the all-pairs equivalent) and the scaling efficiency
+t(1 thread) / (threads * t(threads)), and writes them as JSON:
+
+    python3 -m bench.impls --sizes 1000,5000 --threads 1,2,4 --json bench.json
+    python3 -m bench.impls --json new.json --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from importlib import import_module
+
+import numpy as np
+
+from bench.common import make_planets, step
+from config import Config
+from lib.helper import get_log_func
+
+
+log = get_log_func("[bench]")
+
+SIZES = [1000, 5000, 20000]
+REPEAT = 10
+
+# a larger size is skipped once one step takes longer than this (seconds)
+MAX_STEP_SECONDS = 5.0
+
+
+def measure(impl, sizes, repeat, max_step_seconds, impl_options=None):
+    """
+    time the steps of one implementation in this process
+    :param impl_options: passed to worker.configure() (impl_options of the config)
+    :return: list of {"n", "times"} ("skipped" instead of "times" if too slow)
+    """
+    worker = import_module("native." + impl)
+    if impl_options and hasattr(worker, "configure"):
+        worker.configure(**impl_options)
+    results = []
+    too_slow = False
+    for n in sizes:
+        if too_slow:
+            results.append({"n": n, "skipped": f"step > {max_step_seconds}s at a smaller n"})
+            continue
+
+        planets = make_planets(n)
+        new_planets = planets.__copy__()
+
+        # warm up (and a first guess how long it takes)
+        t_start = time.perf_counter()
+        step(worker, planets, new_planets)
+        t_warm_up = time.perf_counter() - t_start
+
+        times = []
+        for _ in range(repeat if t_warm_up < max_step_seconds else 1):
+            t_start = time.perf_counter()
+            step(worker, planets, new_planets)
+            times.append(time.perf_counter() - t_start)
+        results.append({"n": n, "times": times})
+        too_slow = t_warm_up >= max_step_seconds
+    return results
+
+
+def run_child(impl, threads, sizes, repeat, max_step_seconds, timeout, config):
+    """
+    measure() in a new process with OMP_NUM_THREADS=threads
+    :param config: file name of the config with the impl_options
+    :return: measure()'s results or {"error": ...}
+    """
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads))
+    cmd = [sys.executable, "-m", "bench.impls", "--child", impl, "--config", config,
+           "--sizes", ",".join(str(n) for n in sizes),
+           "--repeat", str(repeat), "--max-step-seconds", str(max_step_seconds)]
+    try:
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"error": f"timeout after {timeout}s"}
+    if proc.returncode != 0:
+        return {"error": (proc.stderr.strip().splitlines() or ["exit code %d" % proc.returncode])[-1]}
+    # the last line is ours, the implementations may print
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(impl, threads, result):
+    """
+    one row per size: median / p95 step time and interactions per second
+    """
+    if "times" not in result:
+        return {"impl": impl, "threads": threads, "n": result["n"], "skipped": result["skipped"]}
+    n = result["n"]
+    times = np.array(result["times"])
+    median = float(np.median(times))
+    return {
+        "impl": impl,
+        "threads": threads,
+        "n": n,
+        "repeat": len(times),
+        "median_s": median,
+        "p95_s": float(np.percentile(times, 95)),
+        "interactions_per_s": n * (n - 1) / median,
+    }
+
+
+def add_efficiency(rows):
+    """
+    efficiency = t(1 thread) / (threads * t(threads)) per impl and n
+    (relative to the smallest measured thread count if 1 is missing)
+    """
+    base = {}
+    for row in sorted((r for r in rows if "median_s" in r), key=lambda r: r["threads"]):
+        key = (row["impl"], row["n"])
+        if key not in base:
+            base[key] = row
+        b = base[key]
+        row["efficiency"] = (b["median_s"] * b["threads"]) / (row["median_s"] * row["threads"])
+
+
+def compare(rows, baseline_file):
+    """
+    log the speedup of every row against the same row in baseline_file
+    """
+    with open(baseline_file) as f:
+        baseline = {(r["impl"], r["n"], r["threads"]): r for r in json.load(f)["results"] if "median_s" in r}
+    log(f"compared to {baseline_file} (> 1: faster now)")
+    for row in rows:
+        if "median_s" not in row:
+            continue
+        old = baseline.get((row["impl"], row["n"], row["threads"]))
+        if old is not None:
+            log(f"  {row['impl']:20s} n={row['n']:<6} threads={row['threads']:<3} "
+                f"{old['median_s'] / row['median_s']:6.2f}x")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def parse_args(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Benchmark the update implementations")
+    parser.add_argument("--impls", type=lambda v: v.split(","),
+                        help="comma separated (default: update_impls of default.cfg.json)")
+    parser.add_argument("--sizes", type=_int_list, default=SIZES, help="comma separated body counts")
+    parser.add_argument("--threads", type=_int_list,
+                        default=sorted({1 << i for i in range(cpus.bit_length())} | {cpus}),
+                        help="comma separated OMP_NUM_THREADS (default: powers of 2 up to the cpu count)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed steps per size")
+    parser.add_argument("--max-step-seconds", type=float, default=MAX_STEP_SECONDS,
+                        help="skip larger sizes once a step takes longer")
+    parser.add_argument("--timeout", type=float, default=600, help="per implementation and thread count")
+    parser.add_argument("--json", help="write the results into this file")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    parser.add_argument("--config", default="default.cfg.json",
+                        help="update_impls and impl_options (default: %(default)s)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = Config(filename=args.config)
+    config.load()
+
+    if args.child is not None:
+        impl_options = getattr(config, "impl_options", {}).get(args.child)
+        print(json.dumps(measure(args.child, args.sizes, args.repeat, args.max_step_seconds, impl_options)))
+        return 0
+
+    impls = args.impls or config.update_impls
+    log(f"sizes {args.sizes}, threads {args.threads}, {args.repeat} steps each")
+
+    rows = []
+    for impl in impls:
+        for threads in args.threads:
+            results = run_child(impl, threads, args.sizes, args.repeat, args.max_step_seconds, args.timeout,
+                                args.config)
+            if isinstance(results, dict):
+                log(f"  {impl:20s} threads={threads:<3} failed: {results['error']}")
+                rows.append({"impl": impl, "threads": threads, "error": results["error"]})
+                continue
+            for result in results:
+                rows.append(summarize(impl, threads, result))
+    add_efficiency(rows)
+
+    for row in rows:
+        if "median_s" in row:
+            log(f"  {row['impl']:20s} n={row['n']:<6} threads={row['threads']:<3} "
+                f"median {row['median_s'] * 1000:9.2f}ms  p95 {row['p95_s'] * 1000:9.2f}ms  "
+                f"{row['interactions_per_s'] / 1e9:7.3f} G interactions/s  eff {row['efficiency']:5.2f}")
+        elif "skipped" in row:
+            log(f"  {row['impl']:20s} n={row['n']:<6} threads={row['threads']:<3} skipped ({row['skipped']})")
+
+    if args.json is not None:
+        meta = {
+            "commit": _git_commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "sizes": args.sizes,
+            "threads": args.threads,
+            "repeat": args.repeat,
+        }
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": rows}, f, indent=2)
+        log(f"results written to {args.json}")
+
+    if args.compare is not None:
+        compare(rows, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Payload size and encode / decode time of the redis array format
+(lib.planet_helper.serialize_np) against the old pickle protocol 0 format
+
+usage: python3 -m bench.wire [n]
+"""
+
+import pickle
+import time
+from sys import argv
+
+from bench.common import make_planets
+from lib.helper import get_log_func
+from lib.planet_helper import serialize_np, deserialize_np
+
+
+log = get_log_func("[wire]")
+
+REPEAT = 20
+
+
+def _best(func, arg):
+    best = float("inf")
+    for _ in range(REPEAT):
+        t_start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - t_start)
+    return best, result
+
+
+def measure(name, encode, decode, arrays):
+    """
+    :return: bytes, encode seconds, decode seconds for all arrays of one step
+    """
+    size = t_encode = t_decode = 0
+    for arr in arrays:
+        t, data = _best(encode, arr)
+        t_encode += t
+        size += len(data)
+        t, _ = _best(decode, data)
+        t_decode += t
+    log(f"  {name:10s} {size / 1024:10.1f} KiB  encode {t_encode * 1000:8.3f}ms  decode {t_decode * 1000:8.3f}ms")
+    return size, t_encode, t_decode
+
+
+def main():
+    n = int(argv[1]) if len(argv) > 1 else 5000
+    planets = make_planets(n)
+
+    # what the master sends per step (pos, speeds, accels; masses once)
+    arrays = [planets.pos, planets.speeds, planets.accels]
+    log(f"n = {n}, pos + speeds + accels ({sum(a.nbytes for a in arrays) / 1024:.1f} KiB raw)")
+
+    old = measure("pickle p0", lambda a: pickle.dumps(a, protocol=0), pickle.loads, arrays)
+    new = measure("binary", serialize_np, deserialize_np, arrays)
+    log(f"  binary / pickle p0: size {new[0] / old[0]:.3f}, encode {new[1] / old[1]:.3f}, "
+        f"decode {new[2] / old[2]:.3f}")
+
+
+if __name__ == '__main__':
+    main()
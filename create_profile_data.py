@@ -2,7 +2,6 @@ from line_profiler import LineProfiler
 
 from native import cyworker as worker
 from lib.planet_helper import load_planets
-from planets import Planets
 
 
 def main():
@@ -10,7 +9,7 @@ def main():
     new_planets = planets.__copy__()
 
     prof = LineProfiler()
-    prof.add_function(worker.update_planet)
+    prof.add_function(worker.update_planet_indices)
     prof.add_function(worker.move_planets)
     prof.runctx("toBench(planets, new_planets)", globals=globals(), locals=locals())
     prof.dump_stats("test.lprof")
@@ -23,7 +22,6 @@ def toBench(planets, new_planets):
                         new_planets.pos,
                         new_planets.speeds,
                         new_planets.accels,
-                        new_planets.masses,
                         planets.n,
                         1500000
                         )
@@ -1,10 +1,27 @@
 from lib.redis_wrapper import RedisWrapper
-from lib.helper import get_log_func, time_ms, chunk_indices
+from lib.helper import get_log_func, time_ms, chunk_indices, assign_chunks, assignment_imbalance
 
 from distributed_queue import TaskManager
 
 log = get_log_func("[DistMaster]")
 
+# weight of the last measurement in the throughput (rows / s) of a worker
+THROUGHPUT_EWMA = 0.3
+# runs without a result until a registered worker is dropped
+STALE_RUNS = 3
+# max. difference between the share of the rows a worker gets and its share
+# of the throughput until the chunks are reassigned (else they stay where their state is)
+REBALANCE_THRESHOLD = 0.1
+# retries of a failed step (each with a new run and the full state) until it is skipped
+STEP_RETRIES = 2
+
+
+class ClusterStepError(Exception):
+    """
+    a step on the cluster could not be completed
+    """
+    pass
+
 
 class DistributedMaster:
     """
@@ -22,9 +39,21 @@ class DistributedMaster:
         self.tm_connected = False
 
         self.masses_pushed = False
+        # chunking of the last full state broadcast,
+        # in between only the positions are sent
+        self.seeded_chunks = None
+        # chunking the workers store the chunk states of in redis
+        self.state_chunks = []
+        # chunk -> worker that computed it last (and keeps its state)
+        self.holders = {}
+        # worker id -> throughput in rows / s, run_id of its last result
+        self.throughput = {}
+        self.last_seen = {}
         self.ok = False
         self.config = config
         self.chunks = config.cluster["chunks"]
+        # seconds to wait for the next result before the step is given up
+        self.result_timeout = config.cluster.get("result_timeout", 30)
         self.run_id = 0
 
         # debug vars
@@ -59,7 +88,32 @@ class DistributedMaster:
 
 
 
-    def calculate_planets(self, planets, new_planets, delta_t):
+    def calculate_planets(self, planets, delta_t):
+        """
+        one simulation step on the cluster,
+        the results are written into the back buffers of planets (new_*)
+
+        A failed step is retried STEP_RETRIES times with a new run and the full state,
+        after that it is skipped (the back buffers get the current state)
+        :return: True if the step was computed
+        """
+        for attempt in range(STEP_RETRIES + 1):
+            try:
+                self._calculate_step(planets, delta_t)
+                return True
+            except ClusterStepError as e:
+                log(f" <!> {e} (attempt {attempt + 1} of {STEP_RETRIES + 1})")
+                # start over with a new run and the full state
+                self.seeded_chunks = None
+                self.run_id += 1
+
+        log(" <!> step skipped")
+        planets.new_pos[:] = planets.pos
+        planets.new_speeds[:] = planets.speeds
+        planets.new_accels[:] = planets.accels
+        return False
+
+    def _calculate_step(self, planets, delta_t):
         # first, clear out queue
         while not self.job_queue.empty():
             log()
@@ -72,64 +126,90 @@ class DistributedMaster:
         index_tuples = list(chunk_indices(planets.n, self.chunks))
         t_chunk_indices = time_ms() - t_start_chunk_indices
 
-        # push planet data to redis
+        # push planet data to redis: the full state on the first run and if the chunking
+        # has changed (the workers keep speeds and accels per chunk), else only the positions
         t_start_dict_update = time_ms()
-        if not self.masses_pushed:
-            self.rds.send_planets(planets.pos, planets.speeds, planets.accels, planets.masses, planets.n)
-            self.masses_pushed = True
+        if index_tuples != self.seeded_chunks:
+            if not self.masses_pushed:
+                self.rds.send_planets(planets.pos, planets.speeds, planets.accels, planets.masses, planets.n,
+                                      self.run_id)
+                self.masses_pushed = True
+            else:
+                self.rds.send_planets_wo_masses(planets.pos, planets.speeds, planets.accels, planets.n, self.run_id)
+            if index_tuples != self.state_chunks:
+                self.rds.delete_chunk_states(self.state_chunks)
+                self.state_chunks = index_tuples
+                self.holders = {}
+            self.seeded_chunks = index_tuples
         else:
-            self.rds.send_planets_wo_masses(planets.pos, planets.speeds, planets.accels, planets.n)
+            self.rds.send_positions(planets.pos)
         t_dict_update = time_ms() - t_start_dict_update
 
-        # distribute jobs to the waiting worker(s)
+        # distribute jobs to the worker(s): one job list per worker,
+        # fast workers steal from the end of the others
         t_start_put = time_ms()
-        for tpl in index_tuples:
-            self.job_queue.put((tpl[0], tpl[1], delta_t, self.run_id))
+        workers, retired = self._workers()
+        if not workers:
+            raise ClusterStepError("no cluster worker registered in redis")
+        assignment = self._assign(index_tuples, workers)
+        owners = {chunk: worker for worker, chunks in assignment.items() for chunk in chunks}
+        self.rds.push_jobs(self.run_id, delta_t, assignment, retired)
+
+        # wake up the workers, each works through the job lists until all are empty
+        for _ in workers:
+            self.job_queue.put((0, 0, delta_t, self.run_id))
         t_put = time_ms() - t_start_put
 
-        # block as long as result is not computed by all workers
-        t_join_start = time_ms()
-        self.job_queue.join()
-        t_join = time_ms() - t_join_start
-
         if self.dg_cluster_result:
             sqsum = 0
 
-        # merge all results from redis
-        # back into our data
+        # merge the results back into our data as they arrive
+        # on the done list, while the other workers still compute
         t_start_redis_apply = time_ms()
-        t_queue = 0
         t_merge_all = 0
-        for tpl in index_tuples:
-            # indices
-            ifrom = tpl[0]
-            ito = tpl[1]
-
+        t_queue = 0
+        t_join = 0
+        rows = {}
+        busy = {}
+        stolen = 0
+        pending = set(index_tuples)
+        while pending:
             t_queue_get: int = time_ms()
-
-            # new: get all redis stuff in
-            key_pos = str(ifrom) + str(ito) + 'pos'
-            key_speeds = str(ifrom) + str(ito) + 'speeds'
-            key_accels = str(ifrom) + str(ito) + 'accels'
-            r_pos, r_speeds, r_accels = self.rds.get_np(key_pos), self.rds.get_np(key_speeds), self.rds.get_np(key_accels)
-
-            # del redis
-            self.rds.delete(key_pos)
-            self.rds.delete(key_speeds)
-            self.rds.delete(key_accels)
-
-            # timing
+            result = self.rds.pop_result(self.run_id, self.result_timeout)
             t_queue += time_ms() - t_queue_get
+            if result is None:
+                raise ClusterStepError(f"run #{self.run_id}: no result for {len(pending)} of "
+                                       f"{len(index_tuples)} jobs within {self.result_timeout}s")
+
+            ifrom, ito, r_pos, r_speeds, r_accels, worker, seconds = result
+            if (ifrom, ito) not in pending:
+                log(f" unexpected result [{ifrom}:{ito}] in run #{self.run_id}, ignored")
+                continue
+            if r_pos is None:
+                raise ClusterStepError(f"run #{self.run_id}: {worker} has no state of [{ifrom}:{ito}]")
+            pending.remove((ifrom, ito))
+            t_join = time_ms() - t_start_put
+            rows[worker] = rows.get(worker, 0) + ito - ifrom
+            busy[worker] = busy.get(worker, 0) + seconds
+            stolen += owners.get((ifrom, ito)) != worker
+            self.holders[(ifrom, ito)] = worker
 
             # merge values in our data
             t_start_merge = time_ms()
-            new_planets.pos[ifrom:ito][:] = r_pos[:][:]
-            new_planets.speeds[ifrom:ito][:] = r_speeds[:][:]
-            new_planets.accels[ifrom:ito][:] = r_accels[:][:]
+            planets.new_pos[ifrom:ito][:] = r_pos[:][:]
+            planets.new_speeds[ifrom:ito][:] = r_speeds[:][:]
+            planets.new_accels[ifrom:ito][:] = r_accels[:][:]
             t_merge_all += time_ms() - t_start_merge
 
         t_redis_apply = time_ms() - t_start_redis_apply
 
+        # measured throughput of the workers for the next assignment
+        for worker, n_rows in rows.items():
+            measured = n_rows / max(busy[worker], 1e-6)
+            previous = self.throughput.get(worker, measured)
+            self.throughput[worker] = THROUGHPUT_EWMA * measured + (1 - THROUGHPUT_EWMA) * previous
+            self.last_seen[worker] = self.run_id
+
         if self.dg_cluster_result:
             log(f"cluster apply sum {sqsum}")
 
@@ -142,17 +222,58 @@ class DistributedMaster:
             log(f"    join         : {t_join}ms")
             log(f"    t_merge      : {t_merge_all}ms")
             log(f"    redis_apply  : {t_redis_apply}ms")
-            log(f"      q_get      : {t_queue}ms")
+            log(f"      wait       : {t_queue}ms")
+            log(f"    stolen       : {stolen} of {len(index_tuples)} jobs")
+            for worker in sorted(rows):
+                log(f"    {worker:24s} {rows[worker]:7d} rows  {self.throughput[worker]:10.0f} rows/s")
             log()
 
         self.run_id += 1
 
+    def _workers(self):
+        """
+        :return: registered workers with a result within the last STALE_RUNS runs
+                 (or registered since then), workers to drop
+        """
+        workers, retired = [], []
+        for worker in self.rds.get_workers():
+            if self.run_id - self.last_seen.setdefault(worker, self.run_id) > STALE_RUNS:
+                retired.append(worker)
+                del self.last_seen[worker]
+                self.throughput.pop(worker, None)
+            else:
+                workers.append(worker)
+        return workers, retired
+
+    def _assign(self, index_tuples, workers):
+        """
+        every chunk stays with the worker that computed it last run (no GET of its state),
+        unless the shares of the rows are more than REBALANCE_THRESHOLD off the throughput,
+        then contiguous ranges sized by the throughput
+        :return: worker -> list of (ifrom, ito)
+        """
+        weights = self._weights(workers)
+        if set(self.holders) == set(index_tuples) and set(self.holders.values()) <= set(workers):
+            kept = [[chunk for chunk in index_tuples if self.holders[chunk] == worker] for worker in workers]
+            if assignment_imbalance(kept, weights) <= REBALANCE_THRESHOLD:
+                return dict(zip(workers, kept))
+        return dict(zip(workers, assign_chunks(index_tuples, weights)))
+
+    def _weights(self, workers):
+        """
+        throughput of the workers, new ones get the mean of the known
+        """
+        known = [self.throughput[worker] for worker in workers if worker in self.throughput]
+        default = sum(known) / len(known) if known else 1.0
+        return [self.throughput.get(worker, default) for worker in workers]
+
     def is_healthy(self):
         return self.ok
 
     def cleanup(self, planets):
         # spray and hope every worker gets at least one job
         # TODO this is bad.........
+        self.seeded_chunks = None
         jobs = 4 * len(list(chunk_indices(planets.n, self.chunks)))
         for i in range(jobs):
             self.job_queue.put((-1337, 0, 0, 0))
\ No newline at end of file
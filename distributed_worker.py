@@ -1,8 +1,16 @@
 from distributed_queue import TaskManager
 from sys import argv, exit
+import os
 import socket
+import time
 
-from native.cyworker import update_planet_indices
+import numpy as np
+
+try:
+    from native.cyworker import update_planet_indices
+except ImportError:
+    # native extensions not built
+    from native.worker_numpy import update_planet_indices
 from lib.redis_wrapper import RedisWrapper
 from lib.helper import time_ms, get_log_func
 from config import Config
@@ -21,7 +29,7 @@ MANAGER_PW = config.cluster["manager_secret"]
 
 
 
-def __worker_function(job_queue):
+def __worker_function(job_queue, worker_id):
 
     run_id_prev = -1
     pos = None
@@ -31,15 +39,20 @@ def __worker_function(job_queue):
     n = None
     masses_and_n_set = False
 
+    # speeds and accels are kept locally across runs, only the slices of
+    # the chunks in chunk_runs (chunk -> run_id they are the input for)
+    # or all of them in the run of the last full state (seed_run) are valid
+    seed_run = -1
+    chunk_runs = {}
+
     # work forever
     while 1:
 
-        # pull a task from the queue (blocking call)
+        # pull a task from the queue (blocking call),
+        # a new run or the special job clear
         t_start_queue = time_ms()
         task = job_queue.get()
-        ifrom, ito, delta_t, run_id = task
-        # special job: clear
-        if ifrom < 0:
+        if task[0] < 0:
             pos = None
             speeds = None
             accels = None
@@ -47,57 +60,84 @@ def __worker_function(job_queue):
             masses_and_n_set = False
             n = None
             run_id_prev = -1
+            seed_run = -1
+            chunk_runs.clear()
             job_queue.task_done()
             log(" <!> data cleared.")
             continue
         t_queue = time_ms() - t_start_queue
 
-
-        # get planet data from redis server
-        # if run_id has changed
-        if run_id != run_id_prev or run_id == 0:
+        # the jobs of the run are on the redis job lists:
+        # work through our own list, then steal from the others
+        while 1:
+            job = rds.next_job(worker_id)
+            if job is None:
+                break
+            ifrom, ito, delta_t, run_id = job
+
+            # get the positions from redis server
+            # if run_id has changed, speeds and accels
+            # only if the master has sent the full state
             t_start_redis = time_ms()
-            if masses_and_n_set:
-                pos, speeds, accels = rds.receive_planets_wo_masses()
-            else:
-                pos, speeds, accels, masses, n = rds.receive_planets()
-                masses_and_n_set = True
+            if run_id != run_id_prev or run_id == 0:
+                pos, seed = rds.receive_positions()
+                if not masses_and_n_set:
+                    masses, n = rds.receive_masses()
+                    masses_and_n_set = True
+                if seed == run_id or speeds is None:
+                    speeds, accels = (np.array(a) for a in rds.receive_speeds_accels())
+                    seed_run = seed
+                    chunk_runs.clear()
+                run_id_prev = run_id
+
+            # state of this chunk from the worker that computed it last run
+            if seed_run != run_id and chunk_runs.get((ifrom, ito)) != run_id:
+                state = rds.get_chunk_state(ifrom, ito)
+                if state is None or state[0] != run_id:
+                    # the master starts over with the full state
+                    log(f" <!> no state of [{ifrom}:{ito}] for run #{run_id}, reported to the master")
+                    rds.push_missing_state(run_id, ifrom, ito, worker_id)
+                    continue
+                speeds[ifrom:ito] = state[2]
+                accels[ifrom:ito] = state[3]
             t_redis = time_ms() - t_start_redis
-        else:
-            t_redis = 0
-
-        # result should contain a tuple of numpy arrays:
-        #  (r_pos, r_speeds, r_accels, ifrom, ito)
-        t_start_calc = time_ms()
-        result = update_planet_indices( pos, speeds, accels, masses,
-                                        n,
-                                        ifrom,
-                                        ito,
-                                        delta_t)
 
+            # result should contain a tuple of numpy arrays:
+            #  (r_pos, r_speeds, r_accels, ifrom, ito)
+            t_start_calc = time_ms()
+            t_start_update = time.perf_counter()
+            result = update_planet_indices( pos, speeds, accels, masses,
+                                            n,
+                                            ifrom,
+                                            ito,
+                                            delta_t)
+            t_update = time.perf_counter() - t_start_update
+
+            # push the result to the done list of this run,
+            # the master merges it as soon as it arrives
+            rds.push_result(run_id, ifrom, ito, result[0], result[1], result[2], worker_id, t_update)
+
+            # keep our part of the state for the next run
+            speeds[ifrom:ito] = result[1]
+            accels[ifrom:ito] = result[2]
+            chunk_runs[(ifrom, ito)] = run_id + 1
+            t_calc = time_ms() - t_start_calc
+
+            # timing information
+            log("Job [{:5d}:{:5d}], run #{}".format(ifrom, ito, run_id))
+            log("  t_queue : {}ms".format(t_queue))
+            log("  t_redis : {}ms".format(t_redis))
+            log("  t_calc  : {}ms".format(t_calc))
+            log()
 
-        # redis send ( TODO FLUSH THIS AFTERWARDS ? )
-        rds.set_np(str(ifrom) + str(ito) + "pos", result[0])
-        rds.set_np(str(ifrom) + str(ito) + "speeds", result[1])
-        rds.set_np(str(ifrom) + str(ito) + "accels", result[2])
-
-        # send back a signal that this job is done
         job_queue.task_done()
-        t_calc = time_ms() - t_start_calc
-
-        # update run_id_prev
-        run_id_prev = run_id
-
-        # timing information
-        log("Job [{:5d}:{:5d}], run #{}".format(ifrom, ito, run_id))
-        log("  t_queue : {}ms".format(t_queue))
-        log("  t_redis : {}ms".format(t_redis))
-        log("  t_calc  : {}ms".format(t_calc))
-        log()
 
 def __start_worker(m):
     job_queue = m.get_job_queue()
-    __worker_function(job_queue)
+    worker_id = "{}:{}".format(socket.gethostname(), os.getpid())
+    rds.register_worker(worker_id)
+    log("registered as {}".format(worker_id))
+    __worker_function(job_queue, worker_id)
 
 if __name__ == '__main__':
 
@@ -0,0 +1,203 @@
+"""
+Off-screen frame export for headless runs (no X server, no OpenGL)
+
+The renderable bodies ([x, y, z, scale] float32, see
+Planets.pos_to_renderable_numpy_array) are splatted into an RGB image
+with NumPy: same camera as galaxy_renderer, every body a shaded disc,
+the nearest body wins per pixel. The images are written as a numbered
+PNG (zlib, no imaging library needed) or raw RGB sequence,
+e.g. for ffmpeg -i frame_%06d.png.
+
+Splatting and encoding run on a thread pool, submit() never waits:
+if all workers are busy the frame is dropped.
+
+>>> image = splat(np.array([[0, 0, 0, 0.2], [0, 0, 5, 0.2]], dtype=np.float32), 64, 48)
+>>> image.shape, image[24, 32].tolist() != [0, 0, 0], image[0, 0].tolist()
+((48, 64, 3), True, [0, 0, 0])
+"""
+
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from math import radians, tan
+
+import numpy as np
+
+from lib.helper import get_log_func
+
+log = get_log_func("[export]")
+
+# same view as galaxy_renderer (camera at (0, 0, 2) looking at the origin)
+_CAMERA_Z = 2.0
+_FOV_Y = 60
+_NEAR = 0.05
+
+# colors of the point sprite path (ambient, diffuse) and of sub-pixel points
+_AMBIENT = np.array((0.2, 0.2, 0.2))
+_DIFFUSE = np.array((0.7, 0.7, 1.4))
+_POINT_COLOR = np.array((0.7, 0.7, 1.0))
+# direction to the light (2, 2, 3) from the camera
+_LIGHT_DIR = np.array((2.0, 2.0, 1.0)) / 3.0
+
+# discs bigger than this (in pixels) are clipped to it
+_MAX_RADIUS = 256
+
+FORMATS = ("png", "raw")
+
+
+@lru_cache(maxsize=None)
+def _stencil(radius):
+    """
+    pixel offsets and colors of a lit sphere with radius pixels
+    :return: (dx, dy, colors (k, 3) uint8)
+    """
+    if radius == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), \
+            (_POINT_COLOR * 255).astype(np.uint8)[np.newaxis]
+
+    dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    d = (dx * dx + dy * dy) / float(radius * radius)
+    inside = d <= 1.0
+    dx, dy, d = dx[inside], dy[inside], d[inside]
+
+    # normal of the sphere facing the camera (image y points down)
+    normal = np.stack((dx / radius, -dy / radius, np.sqrt(1.0 - d)), axis=1)
+    lambert = np.maximum(normal @ _LIGHT_DIR, 0.0)
+    colors = np.clip(_AMBIENT + _DIFFUSE * lambert[:, np.newaxis], 0.0, 1.0)
+    return dx, dy, (colors * 255).astype(np.uint8)
+
+
+def splat(bodies, width, height, fov_y=_FOV_Y):
+    """
+    Rasterise the bodies like the renderer would (without mouse rotation)
+    :param bodies: (n, 4) float32 [x, y, z, scale], scale 0 is hidden
+    :return: (height, width, 3) uint8 RGB image
+    """
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+
+    bodies = np.asarray(bodies, dtype=np.float64)
+    depth = _CAMERA_Z - bodies[:, 2]
+    visible = (depth > _NEAR) & (bodies[:, 3] > 0)
+    bodies, depth = bodies[visible], depth[visible]
+    if len(bodies) == 0:
+        return image
+
+    # perspective projection to pixels
+    pixels_per_unit = height / (2 * tan(radians(fov_y) / 2)) / depth
+    px = np.rint(width / 2 + bodies[:, 0] * pixels_per_unit).astype(np.int64)
+    py = np.rint(height / 2 - bodies[:, 1] * pixels_per_unit).astype(np.int64)
+    radius = np.minimum(np.rint(bodies[:, 3] * pixels_per_unit), _MAX_RADIUS).astype(np.int64)
+
+    # all covered pixels, one stencil per disc size
+    indices, depths, colors = [], [], []
+    for r in np.unique(radius):
+        sel = radius == r
+        dx, dy, c = _stencil(int(r))
+        x = px[sel, np.newaxis] + dx
+        y = py[sel, np.newaxis] + dy
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        indices.append((y * width + x)[inside])
+        depths.append(np.broadcast_to(depth[sel, np.newaxis], x.shape)[inside])
+        colors.append(np.broadcast_to(c, x.shape + (3,))[inside])
+
+    indices = np.concatenate(indices)
+    if len(indices) == 0:
+        return image
+
+    # depth test: nearest first, keep the first occurrence of every pixel
+    order = np.argsort(np.concatenate(depths), kind="stable")
+    indices = indices[order]
+    indices, first = np.unique(indices, return_index=True)
+    image.reshape(-1, 3)[indices] = np.concatenate(colors)[order][first]
+    return image
+
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+
+def write_png(path, image, level=6):
+    """
+    :param image: (height, width, 3) uint8 RGB
+    """
+    height, width, _ = image.shape
+    # every scanline starts with filter type 0 (none)
+    scanlines = np.zeros((height, 1 + width * 3), dtype=np.uint8)
+    scanlines[:, 1:] = image.reshape(height, -1)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(_png_chunk(b"IDAT", zlib.compress(scanlines.tobytes(), level)))
+        f.write(_png_chunk(b"IEND", b""))
+
+
+def write_raw(path, image):
+    """
+    :param image: (height, width, 3) uint8 RGB, written row by row without header
+    """
+    with open(path, "wb") as f:
+        f.write(np.ascontiguousarray(image).tobytes())
+
+
+class FrameExporter:
+    """
+    Exports bodies frames as a numbered image sequence in the background.
+    submit() copies the bodies and returns at once, frames are dropped
+    (and not numbered) while max_pending frames are still being exported
+    """
+    def __init__(self, directory, size=(512, 512), fmt="png", workers=2, max_pending=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown export format '{fmt}', use one of {FORMATS}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.width, self.height = size
+        self.fmt = fmt
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending or 2 * workers
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.frame = 0
+        self.written = 0
+        self.dropped = 0
+
+    def submit(self, bodies):
+        """
+        :param bodies: (n, 4) float32 [x, y, z, scale], may be a view on a receive buffer
+        :return: False if the frame was dropped
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.pending += 1
+
+        path = os.path.join(self.directory, f"frame_{self.frame:06d}.{self.fmt}")
+        self.frame += 1
+        future = self.pool.submit(self._export, np.array(bodies, dtype=np.float32), path)
+        future.add_done_callback(self._done)
+        return True
+
+    def _export(self, bodies, path):
+        image = splat(bodies, self.width, self.height)
+        if self.fmt == "png":
+            write_png(path, image)
+        else:
+            write_raw(path, image)
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+            if future.exception() is None:
+                self.written += 1
+        if future.exception() is not None:
+            log("export failed:", future.exception())
+
+    def close(self):
+        """
+        wait for the pending frames
+        """
+        self.pool.shutdown(wait=True)
+        log(f"exported {self.written} frames to {self.directory} ({self.dropped} dropped)")
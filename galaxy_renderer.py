@@ -29,12 +29,14 @@ except ImportError as e:
     print(' Error: Software not installed properly !!')
     print('OpenGL Error:', e)
     sys.exit()
-from math import floor
+from math import floor, radians, tan
+
+import numpy as np
 
 from mouse_interactor import MouseInteractor
-from simulation_constants import END_MESSAGE
+from point_sprites import PointSprites
 from lib.helper import get_log_func
-import lib.umsgpack as umsgpack
+from lib.frames import FrameInterpolator, FrameReceiver, SharedFrames, FRAME_BODIES, FRAME_END, FRAME_SHM
 
 
 DEBUG_FPS = False
@@ -47,19 +49,33 @@ _WINDOW_SIZE = (512, 512)
 _WINDOW_POSITION = (100, 100)
 _LIGHT_POSITION = (2, 2, 3)
 _CAMERA_POSITION = (0, 0, 2)
+_FOV_Y = 60
+
+# sphere display lists (slices, stacks) and the projected radius in pixels
+# from which on they are used, smaller bodies are drawn as points
+_SPHERE_LODS = ((0.5, 6, 4), (3, 10, 8), (12, 16, 16))
+_POINT_COLOR = (0.7, 0.7, 1.0)
 
 
 class GalaxyRenderer:
     """
         Class containing OpenGL code
     """
-    def __init__(self, render_pipe, fps):
+    def __init__(self, render_pipe, fps, frame_lock=None, render_path="sprites", interpolate=True):
         self.render_pipe = render_pipe
+        self.render_path = render_path
+        self.sprites = None
+        self.frame_receiver = FrameReceiver(render_pipe)
+        self.frame_lock = frame_lock
+        self.shared_frames = None
+        self.frame_seq = 0
+        # blend between the last two simulation frames (render fps > sim fps)
+        self.interpolator = FrameInterpolator() if interpolate else None
         self.fps = fps
         self.max_step_ms = 1000 / fps
         self.bodies = None
         self.do_exit = False
-        self.sphere = None
+        self.spheres = None
         self.init_glut()
         self.init_gl()
         self.mouse_interactor = MouseInteractor(0.01, 1)
@@ -83,13 +99,17 @@ class GalaxyRenderer:
             Initialise OpenGL settings
         """
         # disable vsync
-        self.sphere = GL.glGenLists(1)
-        GL.glNewList(self.sphere, GL.GL_COMPILE)
+        # one display list per level of detail
+        self.spheres = []
         quad_obj = GLU.gluNewQuadric()
         GLU.gluQuadricDrawStyle(quad_obj, GLU.GLU_FILL)
         GLU.gluQuadricNormals(quad_obj, GLU.GLU_SMOOTH)
-        GLU.gluSphere(quad_obj, 1, 16, 16)
-        GL.glEndList()
+        for _, slices, stacks in _SPHERE_LODS:
+            sphere = GL.glGenLists(1)
+            GL.glNewList(sphere, GL.GL_COMPILE)
+            GLU.gluSphere(quad_obj, 1, slices, stacks)
+            GL.glEndList()
+            self.spheres.append(sphere)
         GL.glShadeModel(GL.GL_SMOOTH)
         GL.glEnable(GL.GL_DEPTH_TEST)
         GL.glEnable(GL.GL_CULL_FACE)
@@ -108,12 +128,20 @@ class GalaxyRenderer:
         GL.glMaterialf(GL.GL_FRONT, GL.GL_SHININESS, 20)
         GL.glMatrixMode(GL.GL_PROJECTION)
         GL.glLoadIdentity()
-        GLU.gluPerspective(60, 1, .01, 10)
+        GLU.gluPerspective(_FOV_Y, 1, .01, 10)
         GL.glMatrixMode(GL.GL_MODELVIEW)
 
+        # all bodies in one draw call, if the shaders compile
+        if self.render_path == "sprites":
+            try:
+                self.sprites = PointSprites(_LIGHT_POSITION)
+            except Exception as e:
+                log("point sprites not supported, falling back to spheres:", e)
+
     def render(self):
         """
-            Render the scene using the sphere display list
+            Render the scene using point sprites (one draw call)
+            or the sphere display list (one call per body)
         """
         if self.do_exit:
             print('renderer exiting ...')
@@ -127,22 +155,59 @@ class GalaxyRenderer:
         GL.glLoadIdentity()
         x_size = GLUT.glutGet(GLUT.GLUT_WINDOW_WIDTH)
         y_size = GLUT.glutGet(GLUT.GLUT_WINDOW_HEIGHT)
-        GLU.gluPerspective(60, float(x_size) / float(y_size), 0.05, 10)
+        GLU.gluPerspective(_FOV_Y, float(x_size) / float(y_size), 0.05, 10)
         GL.glMatrixMode(GL.GL_MODELVIEW)
         GL.glLoadIdentity()
         GL.glTranslatef(-_CAMERA_POSITION[0],
                         -_CAMERA_POSITION[1],
                         -_CAMERA_POSITION[2])
         self.mouse_interactor.apply_transformation()
-        for body_index in range(len(self.bodies)):
-            body = self.bodies[body_index]
-            GL.glPushMatrix()
-            GL.glTranslatef(body[0], body[1], body[2])
-            GL.glScalef(body[3], body[3], body[3])
-            GL.glCallList(self.sphere)
-            GL.glPopMatrix()
+        if self.sprites is not None:
+            self.sprites.draw(self.bodies, y_size, _FOV_Y)
+        else:
+            self.render_spheres(y_size)
         GLUT.glutSwapBuffers()
 
+    def render_spheres(self, viewport_height):
+        """
+            Draw every body with the sphere display list that fits its size
+            on the screen, bodies smaller than a pixel as points
+        """
+        bodies = np.asarray(self.bodies, dtype=np.float32)
+        if len(bodies) == 0:
+            return
+
+        # projected radius (in pixels) with the current modelview
+        # (camera + mouse interactor), OpenGL matrices are column major
+        modelview = np.asarray(GL.glGetFloatv(GL.GL_MODELVIEW_MATRIX), dtype=np.float64).reshape(4, 4)
+        eye_z = bodies[:, :3] @ modelview[:3, 2] + modelview[3, 2]
+        scale = np.linalg.norm(modelview[0, :3])
+        pixels_per_unit = viewport_height / (2 * tan(radians(_FOV_Y) / 2))
+        visible = (eye_z < 0) & (bodies[:, 3] > 0)
+        radius_px = np.zeros(len(bodies))
+        radius_px[visible] = bodies[visible, 3] * scale * pixels_per_unit / -eye_z[visible]
+
+        # 0: point, i: self.spheres[i - 1]
+        lod = np.searchsorted([threshold for threshold, _, _ in _SPHERE_LODS], radius_px, side="right")
+
+        points = np.ascontiguousarray(bodies[visible & (lod == 0), :3])
+        if len(points) > 0:
+            GL.glDisable(GL.GL_LIGHTING)
+            GL.glColor3f(*_POINT_COLOR)
+            GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+            GL.glVertexPointer(3, GL.GL_FLOAT, 0, points)
+            GL.glDrawArrays(GL.GL_POINTS, 0, len(points))
+            GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+            GL.glEnable(GL.GL_LIGHTING)
+
+        for level, sphere in enumerate(self.spheres, 1):
+            for body in bodies[visible & (lod == level)]:
+                GL.glPushMatrix()
+                GL.glTranslatef(body[0], body[1], body[2])
+                GL.glScalef(body[3], body[3], body[3])
+                GL.glCallList(sphere)
+                GL.glPopMatrix()
+
     @staticmethod
     def start():
         """
@@ -159,17 +224,28 @@ class GalaxyRenderer:
         t1 = _time_ms()
 
         if self.render_pipe.poll():
-            pipe_input = self.render_pipe.recv_bytes()
-            # unpack
-            unpacked = umsgpack.unpackb(pipe_input)
-            if isinstance(unpacked, str) and unpacked == END_MESSAGE:
+            # bodies is a view on the receive buffer (no unpacking)
+            kind, timestamp, payload = self.frame_receiver.recv()
+            if kind == FRAME_END:
                 self.do_exit = True
-            # elif isinstance(pipe_input, dict):
-            #    pass
-            else:
-                if not self.skip_one:
-                    self.bodies = unpacked
-                    GLUT.glutPostRedisplay()
+            elif kind == FRAME_SHM:
+                log(f"reading frames from shared memory {payload}")
+                self.shared_frames = SharedFrames.attach(payload, self.frame_lock)
+            elif kind == FRAME_BODIES:
+                self.new_frame(payload, timestamp)
+
+        # newest frame from shared memory (older ones are dropped)
+        if self.shared_frames is not None:
+            self.frame_seq, timestamp, bodies = self.shared_frames.read_latest(self.frame_seq)
+            if bodies is not None:
+                self.new_frame(bodies, timestamp)
+
+        # redraw every step, in between the simulation frames
+        if self.interpolator is not None and not self.skip_one:
+            bodies = self.interpolator.at(time.time())
+            if bodies is not None:
+                self.bodies = bodies
+                GLUT.glutPostRedisplay()
 
         if self.skip_one:
             self.skip_one = False
@@ -185,20 +261,34 @@ class GalaxyRenderer:
                 log(f"{t}ms / {self.max_step_ms}ms")
 
 
+    def new_frame(self, bodies, timestamp):
+        """
+            Take a frame from the simulation, bodies is only valid until the next frame
+        """
+        if self.interpolator is not None:
+            self.interpolator.push(bodies, timestamp)
+        elif not self.skip_one:
+            self.bodies = bodies
+            GLUT.glutPostRedisplay()
+
+
 def _time_ms():
     return int(floor(time.time() * 1000))
 
 
-def startup(render_pipe, fps):
+def startup(render_pipe, fps, frame_lock=None, render_path="sprites", interpolate=True):
     """
         Create GalaxyRenderer instance and start rendering
 
         Args:
             render_pipe (multiprocessing.Pipe): Pipe to read positions from
             fps (float): Number of frames per second
+            frame_lock (multiprocessing.Lock): Lock of the shared memory frames
+            render_path (str): "sprites" (one draw call) or "spheres"
+            interpolate (bool): interpolate between the simulation frames
     """
     print('creating renderer')
-    galaxy_renderer = GalaxyRenderer(render_pipe, fps)
+    galaxy_renderer = GalaxyRenderer(render_pipe, fps, frame_lock, render_path, interpolate)
     print('starting renderer')
     galaxy_renderer.start()
     print('done')
@@ -0,0 +1,231 @@
+"""
+Compare every update implementation against a float64 reference
+
+All implementations run k steps from the same planets file. The positions
+and speeds are compared against the reference implementation (max. relative
+error over all bodies), and the momentum and energy drift over the k steps
+is shown. Use this to gate a faster kernel on accuracy before switching
+update_impl: the exit code is 1 if an implementation fails or exceeds its
+tolerance.
+
+usage: python3 kernel_accuracy.py [planets_file] [--planets 1000] [--steps 10]
+                                  [--impls a,b] [--tolerance 1e-9] [--tolerance impl=1e-3]
+       python3 kernel_accuracy.py [planets_file] --fmm-sweep
+
+The approximations (Barnes-Hut, FMM) run with impl_options of the config
+and get looser default tolerances. --fmm-sweep instead prints the error of
+the accelerations of cyworker_fmm for every expansion order / opening angle,
+use it to pick 'order' and 'theta' in impl_options for a given error budget.
+"""
+
+import argparse
+import sys
+import time
+from importlib import import_module
+
+import numpy as np
+
+from config import Config
+from lib.helper import get_log_func
+from lib.planet_helper import load_planets, calc_momentum, calc_momentum_drift, calc_energy
+from planets import Planets
+
+
+log = get_log_func("[accuracy]")
+
+DELTA_T = 27373870
+
+# max. relative position / speed error after the steps
+TOLERANCE = 1e-9
+TOLERANCE_FLOAT32 = 1e-4
+# approximations of the all-pairs sum
+TOLERANCES = {
+    "cyworker_barneshut": 1e-3,
+    "cyworker_fmm": 1e-3,
+}
+
+# --fmm-sweep
+FMM_ORDERS = (1, 2, 3, 4, 5, 6)
+FMM_THETAS = (0.3, 0.5, 0.7)
+
+
+def _run(worker, planets: Planets, steps, delta_t):
+    """
+    steps single steps of worker on a copy of planets
+    :return: the planets after the steps, seconds per step
+    """
+    planets = planets.__copy__()
+    t_start = time.perf_counter()
+    for _ in range(steps):
+        worker.move_planets(planets.pos, planets.speeds, planets.accels, planets.masses,
+                            planets.new_pos, planets.new_speeds, planets.new_accels, planets.n, delta_t)
+        planets.swap()
+    return planets, (time.perf_counter() - t_start) / steps
+
+
+def _rel_err(values, reference):
+    """
+    |values_i - reference_i| / |reference_i| of all bodies
+    (bodies at the origin are compared to the largest |reference_i|)
+    """
+    abs_reference = np.linalg.norm(reference, axis=1)
+    floor = 1e-12 * max(np.max(abs_reference), np.finfo(np.float64).tiny)
+    return np.linalg.norm(values.astype(np.float64) - reference, axis=1) / np.maximum(abs_reference, floor)
+
+
+def _max_rel_err(values, reference):
+    return float(np.max(_rel_err(values, reference)))
+
+
+def _load(filename, max_planets, dtype):
+    planets, _, success = load_planets(filename, dtype)
+    if not success:
+        log(f"could not load {filename}")
+        sys.exit(2)
+
+    # only use the first max_planets
+    if planets.n > max_planets:
+        planets.deserialize({
+            "n": max_planets,
+            "pos": planets.pos[:max_planets],
+            "speeds": planets.speeds[:max_planets],
+            "accels": planets.accels[:max_planets],
+            "masses": planets.masses[:max_planets],
+            "radii": planets.radii[:max_planets],
+            "names": planets.names[:max_planets],
+        })
+    return planets
+
+
+def fmm_sweep(planets: Planets, reference, delta_t):
+    """
+    error of the accelerations of one step of cyworker_fmm for every order / theta,
+    cyworker_barneshut (order "bh") at the same theta for comparison
+    :param reference: the planets after one step of the reference implementation
+    """
+    from native import cyworker_barneshut, cyworker_fmm
+
+    log(" theta  order   max rel. err   99% rel. err   med rel. err     ms/step")
+    for theta in FMM_THETAS:
+        for order in ("bh",) + FMM_ORDERS:
+            if order == "bh":
+                impl = cyworker_barneshut
+                impl.configure(theta=theta)
+            else:
+                impl = cyworker_fmm
+                impl.configure(theta=theta, order=order)
+            result, t_step = _run(impl, planets, 1, delta_t)
+            err = _rel_err(result.accels, reference.accels)
+            log(f"  {theta:0.2f}  {order:>5}   {np.max(err):12.3e}   {np.percentile(err, 99):12.3e}"
+                f"   {np.median(err):12.3e}  {t_step * 1000:10.2f}")
+
+
+def _tolerance(impl, precision, overrides):
+    if impl in overrides:
+        return overrides[impl]
+    if None in overrides:
+        return overrides[None]
+    if precision == "float32":
+        return max(TOLERANCE_FLOAT32, TOLERANCES.get(impl, 0.0))
+    return TOLERANCES.get(impl, TOLERANCE)
+
+
+def _parse_tolerance(value):
+    """
+    "1e-6" -> (None, 1e-6), "cyworker_fmm=1e-3" -> ("cyworker_fmm", 1e-3)
+    """
+    impl, _, tolerance = value.rpartition("=")
+    return impl or None, float(tolerance)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the update implementations against a reference")
+    parser.add_argument("planets_file", nargs="?", default="planets.msgpack")
+    parser.add_argument("--planets", type=int, default=1000, help="use only the first n planets")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--delta-t", type=float, default=DELTA_T)
+    parser.add_argument("--reference", default="worker_numpy",
+                        help="float64 all-pairs implementation (default: %(default)s, or worker_naive)")
+    parser.add_argument("--impls", type=lambda v: v.split(","),
+                        help="comma separated (default: update_impls of default.cfg.json)")
+    parser.add_argument("--precision", choices=("float64", "float32"), default="float64",
+                        help="of the tested implementations (if they support it), the reference is float64")
+    parser.add_argument("--tolerance", type=_parse_tolerance, action="append", default=[],
+                        metavar="[IMPL=]TOL", help="max. relative position / speed error")
+    parser.add_argument("--max-energy-drift", type=float,
+                        help="also fail if the relative energy drift is larger")
+    parser.add_argument("--fmm-sweep", action="store_true",
+                        help="error of one step of cyworker_fmm for every order / theta instead")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = Config("default.cfg.json")
+    impls = [impl for impl in (args.impls or config.update_impls) if impl != args.reference]
+    overrides = dict(args.tolerance)
+    impl_options = getattr(config, "impl_options", {})
+
+    planets = _load(args.planets_file, args.planets, np.float64)
+
+    if args.fmm_sweep:
+        log(f"{planets.n} planets, reference {args.reference} ...")
+        reference, _ = _run(import_module("native." + args.reference), planets, 1, args.delta_t)
+        fmm_sweep(planets, reference, args.delta_t)
+        return 0
+
+    initial_momentum = calc_momentum(planets)
+    initial_energy = calc_energy(planets)
+
+    log(f"{planets.n} planets, {args.steps} steps, reference {args.reference} ...")
+    reference, t_reference = _run(import_module("native." + args.reference), planets, args.steps, args.delta_t)
+    log(f"reference: {t_reference * 1000:.2f}ms/step, momentum drift "
+        f"{calc_momentum_drift(reference, initial_momentum):.3e}, energy drift "
+        f"{abs(calc_energy(reference) - initial_energy) / abs(initial_energy):.3e}")
+    log()
+    log(" implementation        precision    pos. err     speed err  momentum drift  energy drift"
+        "     ms/step  result")
+
+    failed = []
+    for impl in impls:
+        try:
+            worker = import_module("native." + impl)
+            if impl in impl_options and hasattr(worker, "configure"):
+                worker.configure(**impl_options[impl])
+
+            precision = args.precision
+            if precision not in getattr(worker, "PRECISIONS", ("float64",)):
+                precision = "float64"
+            start = planets if precision == "float64" else _load(args.planets_file, args.planets, np.float32)
+
+            result, t_step = _run(worker, start, args.steps, args.delta_t)
+        except Exception as e:
+            log(f" {impl:20s}  failed: {type(e).__name__}: {e}")
+            failed.append(impl)
+            continue
+
+        pos_err = _max_rel_err(result.pos, reference.pos)
+        speed_err = _max_rel_err(result.speeds, reference.speeds)
+        momentum_drift = calc_momentum_drift(result, initial_momentum)
+        energy_drift = abs(calc_energy(result) - initial_energy) / abs(initial_energy)
+
+        tolerance = _tolerance(impl, precision, overrides)
+        ok = np.isfinite(pos_err) and np.isfinite(speed_err) and max(pos_err, speed_err) <= tolerance
+        if args.max_energy_drift is not None:
+            ok = ok and energy_drift <= args.max_energy_drift
+        if not ok:
+            failed.append(impl)
+
+        log(f" {impl:20s}  {precision:9s}  {pos_err:10.3e}  {speed_err:10.3e}  {momentum_drift:14.3e}"
+            f"  {energy_drift:12.3e}  {t_step * 1000:10.2f}  {'ok' if ok else 'FAIL'} (tol {tolerance:.0e})")
+
+    log()
+    if failed:
+        log(f"FAILED: {', '.join(failed)}")
+        return 1
+    log("all implementations within tolerance")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+Binary frame protocol between simulation and renderer
+
+One frame is one message on the pipe: a fixed size header
+followed by the raw payload (no msgpack, no python floats)
+
+    header:  kind (uint32), n (uint32), timestamp (float64, time.time())
+    payload: FRAME_BODIES: n * [x, y, z, scale] float32
+             FRAME_END:    nothing, the receiver should exit
+             FRAME_SHM:    name of a SharedFrames segment (utf-8), n is its capacity,
+                           the bodies come through shared memory from now on
+
+>>> import multiprocessing
+>>> a, b = multiprocessing.Pipe()
+>>> sender, receiver = FrameSender(a), FrameReceiver(b)
+>>> sender.send_bodies(np.arange(8, dtype=np.float32).reshape(2, 4), timestamp=1.5)
+>>> kind, timestamp, bodies = receiver.recv()
+>>> kind == FRAME_BODIES, timestamp, bodies.shape, bodies[1].tolist()
+(True, 1.5, (2, 4), [4.0, 5.0, 6.0, 7.0])
+>>> send_end(a)
+>>> receiver.recv()[0] == FRAME_END
+True
+"""
+
+import struct
+import time
+from multiprocessing import BufferTooShort
+
+import numpy as np
+
+# python >= 3.8
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+SHM_AVAILABLE = shared_memory is not None
+
+
+HEADER = struct.Struct("<IId")
+
+FRAME_BODIES = 1
+FRAME_END = 2
+FRAME_SHM = 3
+
+# floats per body: x, y, z, scale
+BODY_FLOATS = 4
+
+
+def send_end(conn):
+    """
+    tell the receiver on the other end of conn to exit
+    :param conn: multiprocessing Connection
+    """
+    conn.send_bytes(HEADER.pack(FRAME_END, 0, time.time()))
+
+
+class FrameSender:
+    """
+    Sends bodies frames through a multiprocessing Connection.
+    Header and payload are written into one reused buffer,
+    so a frame is always one message
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.buf = bytearray(HEADER.size)
+
+    def send_bodies(self, bodies: np.ndarray, timestamp=None):
+        """
+        :param bodies: (n, 4) float32 [x, y, z, scale]
+        :param timestamp: time of the simulation step, defaults to now
+        """
+        n = len(bodies)
+        size = HEADER.size + n * BODY_FLOATS * 4
+        if len(self.buf) < size:
+            self.buf = bytearray(size)
+
+        HEADER.pack_into(self.buf, 0, FRAME_BODIES, n, time.time() if timestamp is None else timestamp)
+        payload = np.frombuffer(self.buf, dtype=np.float32, count=n * BODY_FLOATS, offset=HEADER.size)
+        payload.reshape((n, BODY_FLOATS))[:] = bodies
+        self.conn.send_bytes(self.buf, 0, size)
+
+    def send_shm(self, name: str, capacity: int):
+        """
+        tell the receiver to read the bodies from the SharedFrames segment name
+        """
+        self.conn.send_bytes(HEADER.pack(FRAME_SHM, capacity, time.time()) + name.encode("utf-8"))
+
+
+class FrameReceiver:
+    """
+    Receives frames from a multiprocessing Connection into a reused buffer.
+    The bodies are a view on that buffer (no copy),
+    they are only valid until the next recv()
+    """
+    def __init__(self, conn, initial_size=1 << 16):
+        self.conn = conn
+        self.buf = bytearray(initial_size)
+        # statistics
+        self.frames_received = 0
+        self.bytes_received = 0
+
+    def recv(self):
+        """
+        blocking, use conn.poll() first
+        :return: (kind, timestamp, payload)
+                 payload: bodies for FRAME_BODIES, the segment name for FRAME_SHM, else None
+        """
+        try:
+            size = self.conn.recv_bytes_into(self.buf)
+        except BufferTooShort as e:
+            # message is bigger than our buffer, grow it for the next frames
+            data = e.args[0]
+            self.buf = bytearray(max(len(data), 2 * len(self.buf)))
+            self.buf[:len(data)] = data
+            size = len(data)
+
+        if size < HEADER.size:
+            raise ValueError(f"frame too short ({size} bytes)")
+        self.frames_received += 1
+        self.bytes_received += size
+        kind, n, timestamp = HEADER.unpack_from(self.buf, 0)
+
+        if kind == FRAME_SHM:
+            return kind, timestamp, bytes(self.buf[HEADER.size:size]).decode("utf-8")
+        if kind != FRAME_BODIES:
+            return kind, timestamp, None
+        bodies = np.frombuffer(self.buf, dtype=np.float32, count=n * BODY_FLOATS, offset=HEADER.size)
+        return kind, timestamp, bodies.reshape((n, BODY_FLOATS))
+
+
+class SharedFrames:
+    """
+    Triple buffer of bodies frames in shared memory (one writer, one reader).
+
+    The writer always writes into the slot that is neither the newest frame
+    nor the one the reader is using, so the reader gets the newest complete
+    frame as a view (no copy), and frames the reader did not get are overwritten.
+    Only the slot bookkeeping is done under the lock.
+
+    segment layout: control (int64 seq, latest, reading, capacity),
+                    n per slot (int64), timestamp per slot (float64),
+                    SLOTS * capacity * [x, y, z, scale] float32
+
+    >>> import multiprocessing
+    >>> writer = SharedFrames.create(10, multiprocessing.Lock())
+    >>> reader = SharedFrames.attach(writer.name, writer.lock)
+    >>> reader.read_latest(0)
+    (0, 0.0, None)
+    >>> writer.write(np.ones((3, 4), dtype=np.float32), timestamp=2.0)
+    >>> writer.write(np.zeros((5, 4), dtype=np.float32), timestamp=3.0)
+    >>> seq, timestamp, bodies = reader.read_latest(0)
+    >>> seq, timestamp, bodies.shape
+    (2, 3.0, (5, 4))
+    >>> reader.read_latest(seq)[2] is None
+    True
+    >>> reader.close(); writer.close(); writer.unlink()
+    """
+    SLOTS = 3
+    _CTRL = 4
+
+    # names of the segments created by this process
+    _created = set()
+
+    def __init__(self, shm, lock, capacity):
+        self.shm = shm
+        self.lock = lock
+        self.name = shm.name
+        self.capacity = capacity
+
+        offset = 0
+        self._ctrl = np.ndarray((self._CTRL,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self._ctrl.nbytes
+        self._n = np.ndarray((self.SLOTS,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self._n.nbytes
+        self._timestamps = np.ndarray((self.SLOTS,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += self._timestamps.nbytes
+        self._slots = np.ndarray((self.SLOTS, capacity, BODY_FLOATS), dtype=np.float32, buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def _size(cls, capacity):
+        return 8 * (cls._CTRL + 2 * cls.SLOTS) + 4 * cls.SLOTS * capacity * BODY_FLOATS
+
+    @classmethod
+    def create(cls, capacity: int, lock):
+        """
+        new segment for frames of up to capacity bodies (writer side)
+        """
+        shm = shared_memory.SharedMemory(create=True, size=cls._size(capacity))
+        cls._created.add(shm.name)
+        frames = cls(shm, lock, capacity)
+        # seq, latest, reading, capacity
+        frames._ctrl[:] = (0, -1, -1, capacity)
+        return frames
+
+    @classmethod
+    def attach(cls, name: str, lock):
+        """
+        existing segment (reader side)
+        """
+        # only the creator owns (unlinks) the segment
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # python < 3.13 always tracks, the tracker would unlink it when the reader exits
+            from multiprocessing import resource_tracker
+            shm = shared_memory.SharedMemory(name=name)
+            if shm.name not in cls._created:
+                resource_tracker.unregister(shm._name, "shared_memory")
+        capacity = int(np.ndarray((cls._CTRL,), dtype=np.int64, buffer=shm.buf)[3])
+        return cls(shm, lock, capacity)
+
+    def write(self, bodies: np.ndarray, timestamp=None):
+        """
+        publish bodies ((n, 4) float32, n <= capacity) as the newest frame
+        """
+        with self.lock:
+            busy = (self._ctrl[1], self._ctrl[2])
+        slot = next(i for i in range(self.SLOTS) if i not in busy)
+
+        n = min(len(bodies), self.capacity)
+        self._slots[slot, :n] = bodies[:n]
+
+        with self.lock:
+            self._n[slot] = n
+            self._timestamps[slot] = time.time() if timestamp is None else timestamp
+            self._ctrl[1] = slot
+            self._ctrl[0] += 1
+
+    def read_latest(self, last_seq: int):
+        """
+        the newest frame, if there is a newer one than last_seq
+        the bodies are a view into shared memory, valid until the next read_latest()
+        :return: (seq, timestamp, bodies or None)
+        """
+        with self.lock:
+            seq = int(self._ctrl[0])
+            if seq == last_seq or self._ctrl[1] < 0:
+                return seq, 0.0, None
+            slot = int(self._ctrl[1])
+            self._ctrl[2] = slot
+            n = int(self._n[slot])
+            timestamp = float(self._timestamps[slot])
+        return seq, timestamp, self._slots[slot, :n]
+
+    def close(self):
+        # drop our views before closing the mapping
+        self._ctrl = self._n = self._timestamps = self._slots = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class FrameInterpolator:
+    """
+    Keeps copies of the last two bodies frames and blends between them,
+    so the renderer can draw at its own fps, independent of the simulation's.
+
+    The display runs one simulation frame behind: a frame that just arrived
+    is reached one frame interval later, so there is always a newer frame
+    to interpolate towards. Row i has to be the same body in both frames,
+    a frame with a different number of bodies is shown as it is (snap).
+
+    >>> interpolator = FrameInterpolator()
+    >>> interpolator.at(0.0) is None
+    True
+    >>> interpolator.push(np.ones((2, 4), dtype=np.float32), timestamp=1.0)
+    >>> interpolator.push(np.full((2, 4), 3, dtype=np.float32), timestamp=2.0)
+    >>> interpolator.at(2.5)[0].tolist()
+    [2.0, 2.0, 2.0, 3.0]
+    >>> interpolator.at(9.0)[0].tolist()
+    [3.0, 3.0, 3.0, 3.0]
+    """
+    def __init__(self):
+        self.prev = None
+        self.cur = None
+        self.out = None
+        self.t_prev = 0.0
+        self.t_cur = 0.0
+
+    def push(self, bodies: np.ndarray, timestamp: float):
+        """
+        new frame, bodies is copied (it may be a view on a receive buffer)
+        :param bodies: (n, 4) float32 [x, y, z, scale]
+        :param timestamp: time of the simulation step
+        """
+        if self.cur is None or len(self.cur) != len(bodies) or timestamp <= self.t_cur:
+            # snap
+            self.prev = np.array(bodies, dtype=np.float32)
+            self.cur = self.prev.copy()
+            self.out = np.empty_like(self.cur)
+            self.t_prev = self.t_cur = timestamp
+            return
+
+        # reuse the buffer of the oldest frame
+        self.prev, self.cur = self.cur, self.prev
+        self.cur[:] = bodies
+        self.t_prev, self.t_cur = self.t_cur, timestamp
+
+    def at(self, t: float):
+        """
+        bodies to display at time t (time.time()), valid until the next call
+        :return: (n, 4) float32 or None if there was no frame yet
+        """
+        if self.cur is None:
+            return None
+        interval = self.t_cur - self.t_prev
+        if interval <= 0:
+            return self.cur
+
+        alpha = min(max((t - self.t_cur) / interval, 0.0), 1.0)
+        out = self.out
+        np.subtract(self.cur[:, :3], self.prev[:, :3], out=out[:, :3])
+        out[:, :3] *= alpha
+        out[:, :3] += self.prev[:, :3]
+        # bodies leaving the view disappear at once, entering ones with the newer frame
+        np.multiply(self.cur[:, 3], self.prev[:, 3] > 0, out=out[:, 3])
+        return out
@@ -46,6 +46,61 @@ def chunk_indices(how_many, chunks):
         i += chunk_size
 
 
+def assign_chunks(chunks, weights):
+    """
+    Split the chunks (tuples of chunk_indices) into len(weights)
+    contiguous runs, each covering about its share weight / sum(weights)
+    of all indices. A chunk goes to the run its middle index lies in.
+
+    >>> assign_chunks([(0, 10), (10, 20), (20, 30), (30, 40)], [1, 1])
+    [[(0, 10), (10, 20)], [(20, 30), (30, 40)]]
+
+    >>> [len(c) for c in assign_chunks(list(chunk_indices(80, 8)), [3, 1])]
+    [6, 2]
+
+    >>> assign_chunks([(0, 10), (10, 20)], [1, 1, 1])
+    [[(0, 10)], [], [(10, 20)]]
+
+    """
+    runs = [[] for _ in weights]
+    if not chunks:
+        return runs
+    start = chunks[0][0]
+    scale = (chunks[-1][1] - start) / sum(weights)
+    k = 0
+    upper = weights[0] * scale
+    for ifrom, ito in chunks:
+        middle = (ifrom + ito) / 2 - start
+        while middle > upper and k < len(weights) - 1:
+            k += 1
+            upper += weights[k] * scale
+        runs[k].append((ifrom, ito))
+    return runs
+
+
+def assignment_imbalance(runs, weights):
+    """
+    Largest difference between the share of all indices a run covers
+    and its share weight / sum(weights)
+
+    >>> assignment_imbalance([[(0, 10), (10, 20)], [(20, 40)]], [1, 1])
+    0.0
+
+    >>> assignment_imbalance([[(0, 30)], [(30, 40)]], [1, 1])
+    0.25
+
+    >>> assignment_imbalance([[(0, 30)], [(30, 40)]], [3, 1])
+    0.0
+
+    """
+    sizes = [sum(ito - ifrom for ifrom, ito in run) for run in runs]
+    total = sum(sizes)
+    if not total:
+        return 0.0
+    scale = sum(weights)
+    return max(abs(size / total - weight / scale) for size, weight in zip(sizes, weights))
+
+
 def __test_chunk_indices(ifrom, ito):
     span = ito - ifrom
     for offset in range(span):
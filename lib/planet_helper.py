@@ -1,19 +1,27 @@
 import numpy as np
 import pickle
+import struct
 
 from lib import umsgpack
 from planets import Planets
 
+# compiled potential energy, NumPy if the native modules are not built
+try:
+    from native import cyenergy
+except ImportError:
+    cyenergy = None
+
 
 
 Z_COORD = np.array((0, 0, 1), dtype=np.float64)
 G = 6.67408e-11
 
 
-def load_planets(filename):
+def load_planets(filename, dtype=np.float64):
     """
 
     :param filename:
+    :param dtype: precision of pos, speeds and accels
     :return: (planets object, mode, success)
     """
 
@@ -29,7 +37,7 @@ def load_planets(filename):
     #print("raw:", raw)
     #print("type(raw):", type(raw))
 
-    planets = Planets(1)
+    planets = Planets(1, dtype)
     planets.deserialize(d["planets"])
     mode = int(d["mode"])
 
@@ -59,11 +67,39 @@ def save_planets(planets, mode, filename):
     return True
 
 
-def serialize_np(arr: np.ndarray):
-    return pickle.dumps(arr, protocol=0)
+# binary array format (redis): magic, dtype (e.g. '<f8'), ndim, shape (uint64 each),
+# followed by the raw C-order buffer
+_NP_MAGIC = b"NPB1"
+_NP_HEADER = struct.Struct("<4s8sB")
+
+
+def serialize_np(arr: np.ndarray) -> bytes:
+    """
+    >>> a = np.arange(6, dtype=np.float64).reshape(2, 3)
+    >>> data = serialize_np(a)
+    >>> len(data) - a.nbytes
+    29
+    >>> b = deserialize_np(data)
+    >>> b.dtype, b.shape, bool(np.all(a == b))
+    (dtype('float64'), (2, 3), True)
+    """
+    arr = np.ascontiguousarray(arr)
+    header = _NP_HEADER.pack(_NP_MAGIC, arr.dtype.str.encode("ascii"), arr.ndim) + \
+        struct.pack(f"<{arr.ndim}Q", *arr.shape)
+    return b"".join((header, arr.data.cast("B")))
+
 
-def deserialize_np(str) -> np.ndarray:
-    return pickle.loads(str)
+def deserialize_np(data) -> np.ndarray:
+    """
+    the array is a read-only view on data (no copy)
+    data in the old format (pickle) is still understood
+    """
+    if data[:len(_NP_MAGIC)] != _NP_MAGIC:
+        return pickle.loads(data)
+    _, dtype, ndim = _NP_HEADER.unpack_from(data, 0)
+    shape = struct.unpack_from(f"<{ndim}Q", data, _NP_HEADER.size)
+    return np.frombuffer(data, dtype=np.dtype(dtype.rstrip(b"\0").decode("ascii")),
+                         offset=_NP_HEADER.size + 8 * ndim).reshape(shape)
 
 
 
@@ -78,11 +114,76 @@ def calc_impulse(planets: Planets):
     the returned value should always stay the same
     while the simulation is running
     """
-    imp = 0
-    for i, mass in enumerate(planets.masses):
-        imp += mass * planets.speeds[i]
+    return np.linalg.norm(calc_momentum(planets))
+
+
+def calc_momentum(planets: Planets):
+    """
+    total momentum vector (sum of m_i * v_i) of all Planets
+    summed up in float64 (also for float32 planets)
+    """
+    return np.sum(planets.masses * planets.speeds, axis=0, dtype=np.float64)
+
+
+def calc_momentum_drift(planets: Planets, initial_momentum: np.ndarray):
+    """
+    change of the total momentum since initial_momentum,
+    relative to the sum of all |m_i * v_i|
+    (the total momentum itself is often close to 0)
+    """
+    scale = np.sum(planets.masses[:, 0] * np.linalg.norm(planets.speeds.astype(np.float64), axis=1))
+    if scale == 0:
+        return 0.0
+    return np.linalg.norm(calc_momentum(planets) - initial_momentum) / scale
+
+
+def calc_kinetic_energy(planets: Planets):
+    """
+    sum of m_i / 2 * |v_i|^2, in float64
+    """
+    speeds = planets.speeds.astype(np.float64, copy=False)
+    return 0.5 * float(np.sum(planets.masses[:, 0] * np.einsum('ij,ij->i', speeds, speeds)))
 
-    return np.linalg.norm(imp)
+
+def calc_potential_energy(planets: Planets):
+    """
+    -G * sum over all pairs i < j of m_i * m_j / |r_i - r_j|, in float64
+    O(n^2), native.cyenergy (OpenMP, without the GIL) if available
+    """
+    if cyenergy is not None:
+        return cyenergy.potential_energy(planets.pos, planets.masses)
+    return _calc_potential_energy_numpy(planets)
+
+
+def _calc_potential_energy_numpy(planets: Planets, block_elements=1 << 18):
+    """
+    blocks of rows against all bodies (like native.worker_numpy),
+    the temporaries stay at O(block_elements)
+    """
+    pos = planets.pos.astype(np.float64, copy=False)
+    m = planets.masses[:, 0]
+    n = planets.n
+    rows = max(1, block_elements // max(n, 1))
+
+    energy = 0.0
+    for b_from in range(0, n, rows):
+        b_to = min(b_from + rows, n)
+        # only j > i
+        d = pos[np.newaxis, b_from + 1:, :] - pos[b_from:b_to, np.newaxis, :]
+        dist = np.sqrt(np.einsum('ijk,ijk->ij', d, d))
+        mask = np.arange(b_from + 1, n)[np.newaxis, :] > np.arange(b_from, b_to)[:, np.newaxis]
+        with np.errstate(divide="ignore"):
+            inv = np.where(mask, 1.0 / dist, 0.0)
+        energy -= float(np.sum(m[b_from:b_to, np.newaxis] * m[np.newaxis, b_from + 1:] * inv))
+    return G * energy
+
+
+def calc_energy(planets: Planets):
+    """
+    total energy (kinetic + potential),
+    the returned value should stay (about) the same while the simulation is running
+    """
+    return calc_kinetic_energy(planets) + calc_potential_energy(planets)
 
 
 # do NOT count the current planet when calculating the point mass
@@ -1,3 +1,5 @@
+import struct
+
 import numpy as np
 
 from . import redis
@@ -7,17 +9,74 @@ from .helper import get_log_func
 
 log = get_log_func("[RedisWrapper]")
 
+# job indices, seconds of computation, whether the worker stored the result
+# as the chunk state (False if it had no state of the job) and length of the
+# worker id of a result on the done list (followed by the worker id)
+_RESULT_HEADER = struct.Struct("<qqd?H")
+# ifrom, ito, delta_t, run_id of a job on a job list
+_JOB = struct.Struct("<qqdq")
+# run_id the pos / speeds / accels of a chunk state are the input for
+_STATE_HEADER = struct.Struct("<q")
+
+# seconds until a done list of a run nobody waits for anymore is removed
+# (the chunk states don't expire, the master deletes them on a new chunking)
+DONE_EXPIRE = 300
+
+
+def done_key(run_id):
+    """
+    redis list the workers push the results of run_id to
+    """
+    return f"done:{run_id}"
+
+
+def jobs_key(worker):
+    """
+    redis list of the jobs assigned to worker
+    """
+    return f"jobs:{worker}"
+
+
+# the next job of worker ARGV[1]: the first of its own list,
+# else steal the last of the list of another worker (KEYS[1]: set of all workers).
+# The job lists are built from the worker ids instead of being declared in KEYS,
+# this only works on a single redis server (not on a redis cluster)
+_NEXT_JOB = """
+local job = redis.call('LPOP', 'jobs:' .. ARGV[1])
+if job then return job end
+for _, worker in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if worker ~= ARGV[1] then
+        job = redis.call('RPOP', 'jobs:' .. worker)
+        if job then return job end
+    end
+end
+return false
+"""
+
+
+def state_key(ifrom, ito):
+    """
+    pos, speeds and accels of the job [ifrom, ito), written by the worker that computed it
+    (the result of the last run, read by the master and the worker of the next run)
+    """
+    return f"state:{ifrom}:{ito}"
+
 
 class RedisWrapper():
     """
     A Redis Wrapper containing specific
     methods to use within planet simulation
+
+    Every method is one network round-trip, except pop_result (two)
+    (the *_many methods use MSET / MGET with many keys, push_jobs / push_result
+    a pipeline, next_job a lua script)
     """
 
     def __init__(self, host='localhost', port=6379, password=''):
         try:
             # redis connection instance
             self.r = redis.StrictRedis(host=host, port=port, password=password, db=0)
+            self._next_job = self.r.register_script(_NEXT_JOB)
             print()
             log()
             log(f"<> connected to {host}:{port}")
@@ -29,36 +88,39 @@ class RedisWrapper():
                        speeds: np.ndarray,
                        accels: np.ndarray,
                        masses: np.ndarray,
-                       n):
-        self.r.set('pos', (serialize_np(pos)))
-        self.r.set('speeds', (serialize_np(speeds)))
-        self.r.set('accels', (serialize_np(accels)))
-        self.r.set('masses', (serialize_np(masses)))
-        self.r.set('n', n)
+                       n,
+                       seed):
+        """
+        full state, seed is the run_id it is the input for
+        """
+        self.set_np_many({'pos': pos, 'speeds': speeds, 'accels': accels, 'masses': masses}, n=n, seed=seed)
 
     def send_planets_wo_masses(self, pos: np.ndarray,
                        speeds: np.ndarray,
                        accels: np.ndarray,
-                       n):
-        self.r.set('pos', (serialize_np(pos)))
-        self.r.set('speeds', (serialize_np(speeds)))
-        self.r.set('accels', (serialize_np(accels)))
-        self.r.set('n', n)
-
-
-    def receive_planets(self):
-        pos = deserialize_np((self.r.get('pos')))
-        speeds = deserialize_np((self.r.get('speeds')))
-        accels = deserialize_np((self.r.get('accels')))
-        masses = deserialize_np((self.r.get('masses')))
-        n = int(self.r.get('n'))
-        return pos, speeds, accels, masses, n
-
-    def receive_planets_wo_masses(self):
-        pos = deserialize_np((self.r.get('pos')))
-        speeds = deserialize_np((self.r.get('speeds')))
-        accels = deserialize_np((self.r.get('accels')))
-        return pos, speeds, accels
+                       n,
+                       seed):
+        self.set_np_many({'pos': pos, 'speeds': speeds, 'accels': accels}, n=n, seed=seed)
+
+    def send_positions(self, pos: np.ndarray):
+        """
+        delta broadcast: only the positions, the workers keep speeds and accels
+        """
+        self.set_np('pos', pos)
+
+    def receive_positions(self):
+        """
+        :return: pos, run_id of the last full state (seed)
+        """
+        pos, seed = self.r.mget(['pos', 'seed'])
+        return deserialize_np(pos), int(seed)
+
+    def receive_masses(self):
+        masses, n = self.r.mget(['masses', 'n'])
+        return deserialize_np(masses), int(n)
+
+    def receive_speeds_accels(self):
+        return tuple(self.get_np_many(['speeds', 'accels']))
 
     def get_np(self, key):
         return deserialize_np((self.r.get(key)))
@@ -68,3 +130,127 @@ class RedisWrapper():
 
     def delete(self, key):
         self.r.delete(key)
+
+    def set_np_many(self, arrays: dict, **values):
+        """
+        set all arrays (and plain values) with one MSET
+        """
+        mapping = {key: serialize_np(val) for key, val in arrays.items()}
+        mapping.update(values)
+        return self.r.mset(mapping)
+
+    def get_np_many(self, keys):
+        """
+        get all arrays with one MGET
+        :return: list of arrays in the order of keys
+        """
+        return [self._deserialize(key, data) for key, data in zip(keys, self.r.mget(keys))]
+
+    def register_worker(self, worker):
+        self.r.sadd('workers', worker)
+
+    def get_workers(self):
+        """
+        :return: ids of all registered workers, sorted
+        """
+        return sorted(worker.decode() for worker in self.r.smembers('workers'))
+
+    def push_jobs(self, run_id, delta_t, assignment: dict, retired=()):
+        """
+        replace the job lists of the workers (one MULTI / EXEC)
+        :param assignment: worker -> list of (ifrom, ito)
+        :param retired: workers to unregister
+        """
+        pipe = self.r.pipeline(transaction=True)
+        for worker in retired:
+            pipe.srem('workers', worker)
+            pipe.delete(jobs_key(worker))
+        for worker, chunks in assignment.items():
+            pipe.delete(jobs_key(worker))
+            if chunks:
+                pipe.rpush(jobs_key(worker), *(_JOB.pack(ifrom, ito, delta_t, run_id) for ifrom, ito in chunks))
+        pipe.execute()
+
+    def next_job(self, worker):
+        """
+        pop the next job of worker, or steal one from another worker
+        :return: ifrom, ito, delta_t, run_id or None if all job lists are empty
+        """
+        job = self._next_job(keys=['workers'], args=[worker])
+        if job is None:
+            return None
+        return _JOB.unpack(job)
+
+    def push_result(self, run_id, ifrom, ito, pos, speeds, accels, worker, seconds):
+        """
+        store the result of the job [ifrom, ito) as the chunk state for run_id + 1
+        and append a reference to it to the done list of run_id (one transaction,
+        the arrays are uploaded once)
+        :param worker: id of the worker that computed it
+        :param seconds: the computation took
+        """
+        worker_id = worker.encode()
+        state = _STATE_HEADER.pack(run_id + 1) + serialize_np(np.stack((pos, speeds, accels)))
+        # MULTI / EXEC: the chunk state is there once the master sees the result
+        pipe = self.r.pipeline(transaction=True)
+        pipe.set(state_key(ifrom, ito), state)
+        pipe.rpush(done_key(run_id), _RESULT_HEADER.pack(ifrom, ito, seconds, True, len(worker_id)) + worker_id)
+        pipe.expire(done_key(run_id), DONE_EXPIRE)
+        pipe.sadd('workers', worker)
+        pipe.execute()
+
+    def push_missing_state(self, run_id, ifrom, ito, worker):
+        """
+        tell the master that worker has no state of the job [ifrom, ito) for run_id
+        (a result without a chunk state on the done list)
+        """
+        worker_id = worker.encode()
+        pipe = self.r.pipeline(transaction=False)
+        pipe.rpush(done_key(run_id), _RESULT_HEADER.pack(ifrom, ito, 0.0, False, len(worker_id)) + worker_id)
+        pipe.expire(done_key(run_id), DONE_EXPIRE)
+        pipe.execute()
+
+    def delete_chunk_states(self, chunks):
+        """
+        delete the states of all chunks (ifrom, ito) with one DEL
+        """
+        if chunks:
+            self.r.delete(*(state_key(ifrom, ito) for ifrom, ito in chunks))
+
+    def get_chunk_state(self, ifrom, ito):
+        """
+        :return: run_id the state is the input for, pos, speeds, accels of the job [ifrom, ito)
+                 or None if there is none
+        """
+        data = self.r.get(state_key(ifrom, ito))
+        if data is None:
+            return None
+        run_id, = _STATE_HEADER.unpack_from(data)
+        pos, speeds, accels = deserialize_np(data[_STATE_HEADER.size:])
+        return run_id, pos, speeds, accels
+
+    def pop_result(self, run_id, timeout):
+        """
+        wait (BLPOP) for the next result on the done list of run_id,
+        then get its chunk state (GET, a second round-trip)
+        :param timeout: whole seconds, 0 waits forever
+        :return: ifrom, ito, pos, speeds, accels, worker, seconds or None after timeout seconds
+                 (pos, speeds, accels are None if the worker had no state of the job
+                 or the chunk state is not the one of this run anymore)
+        """
+        item = self.r.blpop(done_key(run_id), timeout)
+        if item is None:
+            return None
+        data = item[1]
+        ifrom, ito, seconds, stored, id_len = _RESULT_HEADER.unpack_from(data)
+        worker = data[_RESULT_HEADER.size:_RESULT_HEADER.size + id_len].decode()
+        state = self.get_chunk_state(ifrom, ito) if stored else None
+        if state is None or state[0] != run_id + 1:
+            return ifrom, ito, None, None, None, worker, seconds
+        return (ifrom, ito) + state[1:] + (worker, seconds)
+
+    @staticmethod
+    def _deserialize(key, data):
+        if data is None:
+            raise KeyError(f"redis key '{key}' not found")
+        return deserialize_np(data)
@@ -45,6 +45,7 @@ License: MIT
 """
 import struct
 import collections
+import collections.abc
 import sys
 import io
 
@@ -751,7 +752,7 @@ def _unpack_map(code, fp, options):
         if isinstance(k, list):
             # Attempt to convert list into a hashable tuple
             k = _deep_list_to_tuple(k)
-        elif not isinstance(k, collections.Hashable):
+        elif not isinstance(k, collections.abc.Hashable):
             raise UnhashableKeyException(
                 "encountered unhashable key: %s, %s" % (str(k), str(type(k))))
         elif k in d:
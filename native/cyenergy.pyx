@@ -0,0 +1,81 @@
+"""
+Potential energy of all planets (diagnostics)
+
+-G * sum over all pairs i < j of m_i * m_j / |r_i - r_j|,
+OpenMP over blocks of rows i, summed up in double precision
+(also for float32 positions). Releases the GIL, so it can run
+in a background thread while the simulation goes on.
+"""
+
+cimport cython
+from cython.parallel cimport prange
+
+from libc.math cimport sqrt
+
+import numpy as np
+cimport numpy as np
+
+cdef double G = 6.67408e-11
+
+ctypedef fused real:
+    float
+    double
+
+# rows i per block (unit of work of one thread)
+cdef enum:
+    BLOCK_I = 64
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _block(real [:, :] pos, double [:, :] masses, long i_from, long i_to, long n) noexcept nogil:
+    """
+    sum of m_i * m_j / |r_ij| for i in [i_from, i_to), j > i
+    """
+    cdef long i = 0
+    cdef long j = 0
+    cdef double xi = 0.0
+    cdef double yi = 0.0
+    cdef double zi = 0.0
+    cdef double v0 = 0.0
+    cdef double v1 = 0.0
+    cdef double v2 = 0.0
+    cdef double row = 0.0
+    cdef double energy = 0.0
+
+    for i in range(i_from, i_to):
+        xi = pos[i, 0]
+        yi = pos[i, 1]
+        zi = pos[i, 2]
+        row = 0.0
+        for j in range(i + 1, n):
+            v0 = pos[j, 0] - xi
+            v1 = pos[j, 1] - yi
+            v2 = pos[j, 2] - zi
+            row = row + masses[j, 0] / sqrt(v0 * v0 + v1 * v1 + v2 * v2)
+        energy = energy + masses[i, 0] * row
+    return energy
+
+
+cdef double _potential_energy(real [:, :] pos, double [:, :] masses, long n):
+    cdef long b = 0
+    cdef long blocks = (n + BLOCK_I - 1) // BLOCK_I
+    cdef double energy = 0.0
+
+    # dynamic: the rows get shorter towards the end (j > i)
+    with nogil:
+        for b in prange(blocks, schedule='dynamic'):
+            energy += _block(pos, masses, b * BLOCK_I, (b + 1) * BLOCK_I if (b + 1) * BLOCK_I < n else n, n)
+    return -G * energy
+
+
+def potential_energy(np.ndarray positions, np.ndarray masses):
+    """
+    :param positions: (n, 3) float64 or float32
+    :param masses: (n, 1) float64
+    :return: the potential energy (float)
+    """
+    if positions.dtype == np.float32:
+        return _potential_energy[float](positions, masses, len(positions))
+    return _potential_energy[double](positions, masses, len(positions))
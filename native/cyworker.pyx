@@ -58,11 +58,11 @@ def update_planet_indices(np.ndarray o_positions,
     cdef long k = 0
     cdef long dim = 0
 
-    # memory views on numpy arrays
-    cdef double [:, :] p_o_pos = o_positions
-    cdef double [:, :] p_o_speeds = o_speeds
-    cdef double [:, :] p_o_accels = o_accels
-    cdef double [:, :] p_o_masses = o_masses
+    # memory views on numpy arrays (const: the arrays from redis are read-only)
+    cdef const double [:, :] p_o_pos = o_positions
+    cdef const double [:, :] p_o_speeds = o_speeds
+    cdef const double [:, :] p_o_accels = o_accels
+    cdef const double [:, :] p_o_masses = o_masses
 
     # temporary vars (READ-ONLY)
     cdef double delta_t_fast = delta_t
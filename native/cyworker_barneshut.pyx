@@ -0,0 +1,314 @@
+"""
+Barnes-Hut update implementation
+
+Instead of summing up all n^2 pairs, the bodies are put into an octree.
+A cell that appears small enough from the body's point of view
+(cell size / distance < theta) is treated as one point mass
+located at the cell's center of mass.
+This gives O(n log n) per step.
+
+theta = 0 is the exact all-pairs sum, bigger values are faster but less accurate
+(0.3 - 0.7 are sane values)
+"""
+
+cimport cython
+from cython.parallel cimport prange
+
+from libc.math cimport sqrt
+
+import numpy as np
+cimport numpy as np
+
+include "octree.pxi"
+
+cdef double G = 6.67408e-11
+
+# pos, speeds, accels (see pingpong.pxi)
+ctypedef double real
+
+# opening angle and max. number of bodies per leaf
+# (set via configure())
+cdef double THETA = 0.5
+cdef long LEAF_SIZE = 8
+
+# traversal stack per body, every visited cell pushes at most 8 children
+cdef enum:
+    STACK_SIZE = 8 * (OCTREE_MAX_DEPTH + 2)
+
+
+def configure(theta=None, leaf_size=None):
+    """
+    Set the opening angle theta and the leaf size of the octree
+    :param theta:
+    :param leaf_size:
+    :return:
+    """
+    global THETA, LEAF_SIZE
+    if theta is not None:
+        if theta < 0:
+            raise ValueError(f"theta has to be >= 0, got {theta}")
+        THETA = theta
+    if leaf_size is not None:
+        if leaf_size < 1:
+            raise ValueError(f"leaf_size has to be >= 1, got {leaf_size}")
+        LEAF_SIZE = leaf_size
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _accel_for_body(Octree * t, double * x, double * y, double * z, double * m,
+                          long k, double theta_sq, double * a) noexcept nogil:
+    """
+    Walk the tree for the body at tree position k
+    (x, y, z, m are in tree order)
+    and write its acceleration into a[0:3]
+    """
+    cdef long stack[STACK_SIZE]
+    cdef long top = 0
+    cdef long j = 0
+    cdef int o = 0
+    cdef double px = x[k]
+    cdef double py = y[k]
+    cdef double pz = z[k]
+    cdef double v0 = 0.0
+    cdef double v1 = 0.0
+    cdef double v2 = 0.0
+    cdef double dist_sq = 0.0
+    cdef double size = 0.0
+    cdef double tmp = 0.0
+    cdef double a0 = 0.0
+    cdef double a1 = 0.0
+    cdef double a2 = 0.0
+    cdef Node * node
+
+    stack[0] = 0
+    top = 1
+    while top > 0:
+        top -= 1
+        node = &t.nodes[stack[top]]
+
+        v0 = node.mx - px
+        v1 = node.my - py
+        v2 = node.mz - pz
+        dist_sq = v0 * v0 + v1 * v1 + v2 * v2
+        size = 2 * node.half
+
+        # far enough away (and we are not inside): use the center of mass
+        if size * size < theta_sq * dist_sq and not (
+                node.cx - node.half <= px <= node.cx + node.half and
+                node.cy - node.half <= py <= node.cy + node.half and
+                node.cz - node.half <= pz <= node.cz + node.half):
+            tmp = G * node.mass / (dist_sq * sqrt(dist_sq))
+            a0 += tmp * v0
+            a1 += tmp * v1
+            a2 += tmp * v2
+
+        # leaf: sum up directly
+        elif node.leaf:
+            for j in range(node.start, node.start + node.count):
+                if j != k:
+                    v0 = x[j] - px
+                    v1 = y[j] - py
+                    v2 = z[j] - pz
+                    dist_sq = v0 * v0 + v1 * v1 + v2 * v2
+                    tmp = G * m[j] / (dist_sq * sqrt(dist_sq))
+                    a0 += tmp * v0
+                    a1 += tmp * v1
+                    a2 += tmp * v2
+
+        # open the cell
+        else:
+            for o in range(8):
+                if node.child[o] >= 0:
+                    stack[top] = node.child[o]
+                    top += 1
+
+    a[0] = a0
+    a[1] = a1
+    a[2] = a2
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _step(double [:, :] p_o_pos,
+               double [:, :] p_o_speeds,
+               double [:, :] p_o_accels,
+               double [:, :] p_o_masses,
+               double [:, :] p_n_pos,
+               double [:, :] p_n_speeds,
+               double [:, :] p_n_accels,
+               long n,
+               double delta_t) noexcept nogil:
+    """
+    One simulation step, o_* -> n_* (with THETA and LEAF_SIZE)
+    :return: 0 on success, -1 if out of memory
+    """
+    cdef double theta = THETA
+    cdef long leaf_size = LEAF_SIZE
+    cdef Octree t
+    cdef long i = 0
+    cdef long k = 0
+    cdef int dim = 0
+    cdef int ok = 0
+    cdef double delta_t_sq_half = (delta_t ** 2) / 2
+    cdef double theta_sq = theta * theta
+
+    # SoA copies: first in input order (for building),
+    # then in tree order (so the bodies of a leaf are contiguous)
+    cdef double * x = <double *> malloc(n * sizeof(double))
+    cdef double * y = <double *> malloc(n * sizeof(double))
+    cdef double * z = <double *> malloc(n * sizeof(double))
+    cdef double * m = <double *> malloc(n * sizeof(double))
+    cdef double * sx = <double *> malloc(n * sizeof(double))
+    cdef double * sy = <double *> malloc(n * sizeof(double))
+    cdef double * sz = <double *> malloc(n * sizeof(double))
+    cdef double * sm = <double *> malloc(n * sizeof(double))
+
+    # accelerations in tree order
+    cdef double * acc = <double *> malloc(3 * n * sizeof(double))
+
+    t.nodes = NULL
+    t.order = NULL
+    t.tmp = NULL
+    if x == NULL or y == NULL or z == NULL or m == NULL or \
+            sx == NULL or sy == NULL or sz == NULL or sm == NULL or acc == NULL:
+        ok = -1
+
+    if ok == 0:
+        for i in range(n):
+            x[i] = p_o_pos[i, 0]
+            y[i] = p_o_pos[i, 1]
+            z[i] = p_o_pos[i, 2]
+            m[i] = p_o_masses[i, 0]
+        ok = octree_build(&t, x, y, z, m, n, leaf_size)
+
+    if ok == 0:
+        for k in range(n):
+            i = t.order[k]
+            sx[k] = x[i]
+            sy[k] = y[i]
+            sz[k] = z[i]
+            sm[k] = m[i]
+
+        # walk the tree once per body, in tree order
+        # (neighbouring bodies visit mostly the same cells)
+        for k in prange(n, schedule='guided'):
+            _accel_for_body(&t, sx, sy, sz, sm, k, theta_sq, &acc[3 * k])
+
+        for k in prange(n, schedule='static'):
+            i = t.order[k]
+            for dim in range(3):
+                p_n_accels[i, dim] = acc[3 * k + dim]
+                p_n_pos[i, dim] = p_o_pos[i, dim] + delta_t * p_o_speeds[i, dim] + delta_t_sq_half * p_o_accels[i, dim]
+                p_n_speeds[i, dim] = p_o_speeds[i, dim] + acc[3 * k + dim] * delta_t
+
+    octree_free(&t)
+    free(x)
+    free(y)
+    free(z)
+    free(m)
+    free(sx)
+    free(sy)
+    free(sz)
+    free(sm)
+    free(acc)
+    return ok
+
+
+include "pingpong.pxi"
+
+
+def move_planets(np.ndarray o_positions,
+                        np.ndarray o_speeds,
+                        np.ndarray o_accels,
+                        np.ndarray o_masses,
+                        np.ndarray n_positions,
+                        np.ndarray n_speeds,
+                        np.ndarray n_accels,
+                        num_planets,
+                        delta_t):
+    """
+    o_* represent old planet data
+    n_* represent the planet data we write into
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :return:
+    """
+
+    move_planets_n(o_positions, o_speeds, o_accels, o_masses,
+                   n_positions, n_speeds, n_accels, num_planets, delta_t, 1)
+
+
+def move_planets_n(np.ndarray o_positions,
+                          np.ndarray o_speeds,
+                          np.ndarray o_accels,
+                          np.ndarray o_masses,
+                          np.ndarray n_positions,
+                          np.ndarray n_speeds,
+                          np.ndarray n_accels,
+                          num_planets,
+                          delta_t,
+                          steps=1,
+                          t_positions=None,
+                          t_speeds=None,
+                          t_accels=None):
+    """
+    Perform steps simulation steps in one call (without the GIL in between)
+    The steps alternate between n_* and internal buffers,
+    only the state after the last step is written into n_*
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :param delta_t:
+    :param steps: number of steps (>= 1)
+    :param t_*: buffers for the intermediate steps (allocated if None)
+    :return:
+    """
+
+    cdef long n = num_planets
+    cdef long k = steps
+    cdef double delta_t_fast = delta_t
+    cdef int ok = 0
+
+    if k < 1:
+        raise ValueError(f"steps must be >= 1, got {steps}")
+
+    # memory views on numpy arrays
+    cdef double [:, :] p_o_pos = o_positions
+    cdef double [:, :] p_o_speeds = o_speeds
+    cdef double [:, :] p_o_accels = o_accels
+    cdef double [:, :] p_o_masses = o_masses
+    cdef double [:, :] p_n_pos = n_positions
+    cdef double [:, :] p_n_speeds = n_speeds
+    cdef double [:, :] p_n_accels = n_accels
+
+    # ping-pong buffers for the intermediate steps
+    if k == 1:
+        t_positions, t_speeds, t_accels = n_positions, n_speeds, n_accels
+    elif t_positions is None:
+        t_positions, t_speeds, t_accels = np.empty_like(n_positions), np.empty_like(n_speeds), np.empty_like(n_accels)
+    cdef double [:, :] p_t_pos = t_positions
+    cdef double [:, :] p_t_speeds = t_speeds
+    cdef double [:, :] p_t_accels = t_accels
+
+    if n == 0:
+        return
+
+    ok = _move_planets_n(p_o_pos, p_o_speeds, p_o_accels, p_o_masses,
+                         p_n_pos, p_n_speeds, p_n_accels,
+                         p_t_pos, p_t_speeds, p_t_accels, n, delta_t_fast, k)
+    if ok != 0:
+        raise MemoryError("could not allocate the octree")
@@ -0,0 +1,722 @@
+"""
+Fast multipole update implementation
+
+Uses the same octree as cyworker_barneshut, but instead of walking the tree
+once per body, pairs of cells are walked (dual tree walk).
+If two cells are far enough apart ((r_target + r_source) < theta * distance)
+the source cell's multipole expansion is turned into a local (taylor)
+expansion around the target cell's center of mass (M2L).
+The local expansions are then shifted down the tree (L2L) and evaluated
+at every body (L2P). Leaves evaluate the multipole expansion directly
+at their bodies (M2P). Cells that are too close are summed up directly (P2P).
+This gives ~O(n) per step.
+
+Expansion order p (cartesian, 1 - MAX_ORDER): every interaction keeps the
+terms M_a D_(a+b) with |a| + |b| <= p, a multipole moments (up to |a| = p - 1)
+and b local coefficients (up to |b| = p), e.g.
+    1: monopole, constant field per cell
+    2: monopole, field + gradient per cell
+    3: monopole + quadrupole, field + gradient + hessian per cell
+    4: + octupole, quadrupole -> gradient, ...
+The error drops by about theta per order.
+
+Use `kernel_accuracy.py --fmm-sweep` to compare the orders against worker_naive.
+"""
+
+cimport cython
+from cython.parallel cimport prange
+
+from libc.math cimport sqrt
+from libc.string cimport memset
+
+import numpy as np
+cimport numpy as np
+
+include "octree.pxi"
+
+cdef double G = 6.67408e-11
+
+# pos, speeds, accels (see pingpong.pxi)
+ctypedef double real
+
+# opening angle, expansion order and max. number of bodies per leaf
+# (set via configure())
+cdef double THETA = 0.5
+cdef int ORDER = 3
+cdef long LEAF_SIZE = 16
+
+# number of independent subtrees the walk is split into (for OpenMP)
+cdef enum:
+    MIN_FRONTIER = 256
+
+# highest expansion order, number of multi-indices (a, b, c) with a + b + c <= MAX_ORDER
+cdef enum:
+    MAX_ORDER = 8
+    MAX_TERMS = 165
+
+# multi-indices ordered by degree (1, x, y, z, xx, xy, xz, yy, ...)
+# EXP: exponents, DEG: degree, INDEX: inverse of EXP,
+# UP / DOWN / DOWN2: index of t + e_j / t - e_j / t - 2 e_j (-1 if there is none),
+# FIRST: first dimension with a non zero exponent,
+# N_TERMS[d]: number of multi-indices with degree <= d
+cdef int EXP[MAX_TERMS][3]
+cdef int DEG[MAX_TERMS]
+cdef int INDEX[MAX_ORDER + 1][MAX_ORDER + 1][MAX_ORDER + 1]
+cdef int UP[MAX_TERMS][3]
+cdef int DOWN[MAX_TERMS][3]
+cdef int DOWN2[MAX_TERMS][3]
+cdef int FIRST[MAX_TERMS]
+cdef int N_TERMS[MAX_ORDER + 1]
+
+
+cdef void _init_terms():
+    """
+    Fill the multi-index tables
+    """
+    cdef int t = 0
+    cdef int d = 0
+    cdef int a = 0
+    cdef int b = 0
+    cdef int j = 0
+    cdef int e[3]
+
+    for d in range(MAX_ORDER + 1):
+        for a in range(d, -1, -1):
+            for b in range(d - a, -1, -1):
+                EXP[t][0] = a
+                EXP[t][1] = b
+                EXP[t][2] = d - a - b
+                DEG[t] = d
+                INDEX[a][b][d - a - b] = t
+                t += 1
+        N_TERMS[d] = t
+
+    for t in range(MAX_TERMS):
+        FIRST[t] = -1
+        for j in range(3):
+            if FIRST[t] < 0 and EXP[t][j] > 0:
+                FIRST[t] = j
+            e[0] = EXP[t][0]
+            e[1] = EXP[t][1]
+            e[2] = EXP[t][2]
+            e[j] += 1
+            UP[t][j] = INDEX[e[0]][e[1]][e[2]] if DEG[t] < MAX_ORDER else -1
+            e[j] -= 2
+            DOWN[t][j] = INDEX[e[0]][e[1]][e[2]] if e[j] >= 0 else -1
+            e[j] -= 1
+            DOWN2[t][j] = INDEX[e[0]][e[1]][e[2]] if e[j] >= 0 else -1
+
+
+_init_terms()
+
+
+def configure(theta=None, order=None, leaf_size=None):
+    """
+    Set the opening angle theta, the expansion order (1 - MAX_ORDER)
+    and the leaf size of the octree
+    :param theta:
+    :param order:
+    :param leaf_size:
+    :return:
+    """
+    global THETA, ORDER, LEAF_SIZE
+    if theta is not None:
+        if not 0 < theta < 1:
+            raise ValueError(f"theta has to be in (0, 1), got {theta}")
+        THETA = theta
+    if order is not None:
+        if not 1 <= order <= MAX_ORDER:
+            raise ValueError(f"order has to be in [1, {MAX_ORDER}], got {order}")
+        ORDER = order
+    if leaf_size is not None:
+        if leaf_size < 1:
+            raise ValueError(f"leaf_size has to be >= 1, got {leaf_size}")
+        LEAF_SIZE = leaf_size
+
+
+cdef struct Fmm:
+    Octree t
+
+    # bodies in tree order
+    double * x
+    double * y
+    double * z
+    double * m
+    double * acc
+
+    # per node: multipole moments (n_mpole), radius around the center of mass,
+    # local expansion (n_local)
+    double * mpole
+    double * rmax
+    double * local
+
+    double theta
+    int order
+    int n_mpole
+    int n_local
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _powers(double * e, int p, double * out) noexcept nogil:
+    """
+    out[t] = e^EXP[t] / EXP[t]! for all multi-indices up to degree p
+    """
+    cdef int t = 0
+    cdef int j = 0
+
+    out[0] = 1.0
+    for t in range(1, N_TERMS[p]):
+        j = FIRST[t]
+        out[t] = out[DOWN[t][j]] * e[j] / EXP[t][j]
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _derivs(double * R, int p, double * D) noexcept nogil:
+    """
+    D[t] = d^EXP[t] / dR^EXP[t] 1 / |R| for all multi-indices up to degree p
+    (recurrence from differentiating r^2 D_0 = 1 / r)
+    """
+    cdef double inv_r_sq = 1.0 / (R[0] * R[0] + R[1] * R[1] + R[2] * R[2])
+    cdef double s = 0.0
+    cdef int t = 0
+    cdef int i = 0
+    cdef int j = 0
+    cdef int m = 0
+
+    D[0] = sqrt(inv_r_sq)
+    for t in range(1, N_TERMS[p]):
+        i = FIRST[t]
+        s = R[i] * D[DOWN[t][i]]
+        for j in range(3):
+            m = EXP[t][j] - (1 if j == i else 0)
+            if m >= 1:
+                s += 2 * m * R[j] * D[DOWN[t][j]]
+            if m >= 2:
+                s += m * (m - 1) * D[DOWN2[t][j]]
+        m = EXP[t][i] - 1
+        if m >= 1:
+            s += m * D[DOWN2[t][i]]
+        D[t] = -s * inv_r_sq
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _upward(Fmm * f) noexcept nogil:
+    """
+    Multipole moments M[a] = sum m (center - x)^a / a! and radii of all nodes
+    (children first)
+    """
+    cdef long idx = 0
+    cdef long c = 0
+    cdef long k = 0
+    cdef int o = 0
+    cdef int a = 0
+    cdef int g = 0
+    cdef double d[3]
+    cdef double e[MAX_TERMS]
+    cdef double * M
+    cdef double * C
+    cdef double r = 0.0
+    cdef double r_geo = 0.0
+    cdef Node * node
+    cdef Node * child
+
+    # nodes are numbered in pre-order, so every child comes after its parent
+    idx = f.t.n_nodes - 1
+    while idx >= 0:
+        node = &f.t.nodes[idx]
+        M = &f.mpole[f.n_mpole * idx]
+        memset(M, 0, f.n_mpole * sizeof(double))
+        f.rmax[idx] = 0.0
+
+        if node.leaf:
+            for k in range(node.start, node.start + node.count):
+                d[0] = node.mx - f.x[k]
+                d[1] = node.my - f.y[k]
+                d[2] = node.mz - f.z[k]
+                _powers(d, f.order - 1, e)
+                for a in range(f.n_mpole):
+                    M[a] += f.m[k] * e[a]
+                r = sqrt(d[0] * d[0] + d[1] * d[1] + d[2] * d[2])
+                if r > f.rmax[idx]:
+                    f.rmax[idx] = r
+        else:
+            for o in range(8):
+                c = node.child[o]
+                if c < 0:
+                    continue
+                child = &f.t.nodes[c]
+                C = &f.mpole[f.n_mpole * c]
+                d[0] = node.mx - child.mx
+                d[1] = node.my - child.my
+                d[2] = node.mz - child.mz
+
+                # M2M: M[a] += sum_(g <= a) C[g] d^(a - g) / (a - g)!
+                _powers(d, f.order - 1, e)
+                for a in range(f.n_mpole):
+                    for g in range(N_TERMS[DEG[a]]):
+                        if EXP[g][0] <= EXP[a][0] and EXP[g][1] <= EXP[a][1] and EXP[g][2] <= EXP[a][2]:
+                            M[a] += C[g] * e[INDEX[EXP[a][0] - EXP[g][0]][EXP[a][1] - EXP[g][1]][EXP[a][2] - EXP[g][2]]]
+                r = sqrt(d[0] * d[0] + d[1] * d[1] + d[2] * d[2]) + f.rmax[c]
+                if r > f.rmax[idx]:
+                    f.rmax[idx] = r
+
+            # the cube itself is a bound too
+            d[0] = node.mx - node.cx
+            d[1] = node.my - node.cy
+            d[2] = node.mz - node.cz
+            r_geo = sqrt(d[0] * d[0] + d[1] * d[1] + d[2] * d[2]) + node.half * sqrt(3.0)
+            if r_geo < f.rmax[idx]:
+                f.rmax[idx] = r_geo
+
+        idx -= 1
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _m2l(Fmm * f, long target, long source) noexcept nogil:
+    """
+    Add the source's multipole expansion to the target's local expansion,
+    L[b] -= G sum_(|a| + |b| <= p) M[a] D[a + b]
+    """
+    cdef Node * tn = &f.t.nodes[target]
+    cdef Node * sn = &f.t.nodes[source]
+    cdef double * L = &f.local[f.n_local * target]
+    cdef double * M = &f.mpole[f.n_mpole * source]
+    cdef double R[3]
+    cdef double D[MAX_TERMS]
+    cdef double tmp = 0.0
+    cdef int a = 0
+    cdef int b = 0
+
+    R[0] = tn.mx - sn.mx
+    R[1] = tn.my - sn.my
+    R[2] = tn.mz - sn.mz
+    _derivs(R, f.order, D)
+
+    # L[0] (the potential) is never needed
+    for b in range(1, f.n_local):
+        tmp = 0.0
+        for a in range(N_TERMS[f.order - DEG[b]]):
+            tmp += M[a] * D[INDEX[EXP[a][0] + EXP[b][0]][EXP[a][1] + EXP[b][1]][EXP[a][2] + EXP[b][2]]]
+        L[b] -= G * tmp
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _m2p(Fmm * f, long target, long source) noexcept nogil:
+    """
+    Evaluate the source's multipole expansion directly at the bodies of target
+    (used for leaves, no error from the local expansion),
+    a_i = G sum_(|a| < p) M[a] D[a + e_i]
+    """
+    cdef Node * tn = &f.t.nodes[target]
+    cdef Node * sn = &f.t.nodes[source]
+    cdef double * M = &f.mpole[f.n_mpole * source]
+    cdef double R[3]
+    cdef double D[MAX_TERMS]
+    cdef long k = 0
+    cdef int a = 0
+    cdef int i = 0
+
+    for k in range(tn.start, tn.start + tn.count):
+        R[0] = f.x[k] - sn.mx
+        R[1] = f.y[k] - sn.my
+        R[2] = f.z[k] - sn.mz
+        _derivs(R, f.order, D)
+        for a in range(f.n_mpole):
+            for i in range(3):
+                f.acc[3 * k + i] += G * M[a] * D[UP[a][i]]
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _p2p(Fmm * f, long target, long source) noexcept nogil:
+    """
+    Direct sum, bodies of source -> bodies of target
+    """
+    cdef Node * tn = &f.t.nodes[target]
+    cdef Node * sn = &f.t.nodes[source]
+    cdef long k = 0
+    cdef long j = 0
+    cdef double v0 = 0.0
+    cdef double v1 = 0.0
+    cdef double v2 = 0.0
+    cdef double a0 = 0.0
+    cdef double a1 = 0.0
+    cdef double a2 = 0.0
+    cdef double dist_sq = 0.0
+    cdef double tmp = 0.0
+
+    for k in range(tn.start, tn.start + tn.count):
+        a0 = 0.0
+        a1 = 0.0
+        a2 = 0.0
+        for j in range(sn.start, sn.start + sn.count):
+            if j != k:
+                v0 = f.x[j] - f.x[k]
+                v1 = f.y[j] - f.y[k]
+                v2 = f.z[j] - f.z[k]
+                dist_sq = v0 * v0 + v1 * v1 + v2 * v2
+                tmp = G * f.m[j] / (dist_sq * sqrt(dist_sq))
+                a0 += tmp * v0
+                a1 += tmp * v1
+                a2 += tmp * v2
+        f.acc[3 * k + 0] += a0
+        f.acc[3 * k + 1] += a1
+        f.acc[3 * k + 2] += a2
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _interact(Fmm * f, long target, long source) noexcept nogil:
+    """
+    Dual tree walk, only writes into the target's subtree
+    """
+    cdef Node * tn = &f.t.nodes[target]
+    cdef Node * sn = &f.t.nodes[source]
+    cdef double v0 = 0.0
+    cdef double v1 = 0.0
+    cdef double v2 = 0.0
+    cdef double r = 0.0
+    cdef int o = 0
+    cdef int p = 0
+
+    if target == source:
+        if tn.leaf:
+            _p2p(f, target, source)
+        else:
+            for o in range(8):
+                if tn.child[o] < 0:
+                    continue
+                for p in range(8):
+                    if tn.child[p] >= 0:
+                        _interact(f, tn.child[o], tn.child[p])
+        return
+
+    v0 = tn.mx - sn.mx
+    v1 = tn.my - sn.my
+    v2 = tn.mz - sn.mz
+    r = f.rmax[target] + f.rmax[source]
+    if r * r < f.theta * f.theta * (v0 * v0 + v1 * v1 + v2 * v2):
+        if tn.leaf:
+            _m2p(f, target, source)
+        else:
+            _m2l(f, target, source)
+    elif tn.leaf and sn.leaf:
+        _p2p(f, target, source)
+
+    # split the bigger one
+    elif tn.leaf or (not sn.leaf and f.rmax[source] > f.rmax[target]):
+        for o in range(8):
+            if sn.child[o] >= 0:
+                _interact(f, target, sn.child[o])
+    else:
+        for o in range(8):
+            if tn.child[o] >= 0:
+                _interact(f, tn.child[o], source)
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _downward(Fmm * f, long idx) noexcept nogil:
+    """
+    Shift the local expansion of node idx to its children (L2L)
+    or evaluate it at the bodies (L2P)
+    """
+    cdef Node * node = &f.t.nodes[idx]
+    cdef double * L = &f.local[f.n_local * idx]
+    cdef double * C
+    cdef double d[3]
+    cdef double e[MAX_TERMS]
+    cdef long c = 0
+    cdef long k = 0
+    cdef int o = 0
+    cdef int b = 0
+    cdef int g = 0
+    cdef int i = 0
+
+    if node.leaf:
+        for k in range(node.start, node.start + node.count):
+            d[0] = f.x[k] - node.mx
+            d[1] = f.y[k] - node.my
+            d[2] = f.z[k] - node.mz
+
+            # a_i = -sum_(|b| < p) L[b + e_i] d^b / b!
+            _powers(d, f.order - 1, e)
+            for b in range(f.n_mpole):
+                for i in range(3):
+                    f.acc[3 * k + i] -= L[UP[b][i]] * e[b]
+        return
+
+    for o in range(8):
+        c = node.child[o]
+        if c < 0:
+            continue
+        C = &f.local[f.n_local * c]
+        d[0] = f.t.nodes[c].mx - node.mx
+        d[1] = f.t.nodes[c].my - node.my
+        d[2] = f.t.nodes[c].mz - node.mz
+
+        # C[g] += sum_(b >= g) L[b] d^(b - g) / (b - g)!
+        _powers(d, f.order, e)
+        for g in range(1, f.n_local):
+            for b in range(N_TERMS[DEG[g] - 1], f.n_local):
+                if EXP[b][0] >= EXP[g][0] and EXP[b][1] >= EXP[g][1] and EXP[b][2] >= EXP[g][2]:
+                    C[g] += L[b] * e[INDEX[EXP[b][0] - EXP[g][0]][EXP[b][1] - EXP[g][1]][EXP[b][2] - EXP[g][2]]]
+        _downward(f, c)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef long _frontier(Fmm * f, long * frontier, long max_size) noexcept nogil:
+    """
+    Split the tree into disjoint subtrees (covering all bodies)
+    which can be handled independently
+    :return: number of subtrees written into frontier
+    """
+    cdef long size = 1
+    cdef long new_size = 0
+    cdef long grown = 1
+    cdef long i = 0
+    cdef long * buf = <long *> malloc(max_size * sizeof(long))
+    cdef long * tmp
+    cdef Node * node
+    cdef int o = 0
+
+    frontier[0] = 0
+    if buf == NULL:
+        return 1
+
+    while size < MIN_FRONTIER and grown:
+        grown = 0
+        new_size = 0
+        for i in range(size):
+            node = &f.t.nodes[frontier[i]]
+            if node.leaf:
+                buf[new_size] = frontier[i]
+                new_size += 1
+            else:
+                grown = 1
+                for o in range(8):
+                    if node.child[o] >= 0:
+                        buf[new_size] = node.child[o]
+                        new_size += 1
+        for i in range(new_size):
+            frontier[i] = buf[i]
+        size = new_size
+
+    free(buf)
+    return size
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _step(double [:, :] p_o_pos,
+               double [:, :] p_o_speeds,
+               double [:, :] p_o_accels,
+               double [:, :] p_o_masses,
+               double [:, :] p_n_pos,
+               double [:, :] p_n_speeds,
+               double [:, :] p_n_accels,
+               long n,
+               double delta_t) noexcept nogil:
+    """
+    One simulation step, o_* -> n_* (with THETA, ORDER and LEAF_SIZE)
+    :return: 0 on success, -1 if out of memory
+    """
+    cdef double theta = THETA
+    cdef int order = ORDER
+    cdef long leaf_size = LEAF_SIZE
+    cdef Fmm f
+    cdef long i = 0
+    cdef long k = 0
+    cdef long s = 0
+    cdef long n_frontier = 0
+    cdef long * frontier = NULL
+    cdef int dim = 0
+    cdef int ok = 0
+    cdef double delta_t_sq_half = (delta_t ** 2) / 2
+
+    # SoA copies in input order (for building)
+    cdef double * x = <double *> malloc(n * sizeof(double))
+    cdef double * y = <double *> malloc(n * sizeof(double))
+    cdef double * z = <double *> malloc(n * sizeof(double))
+    cdef double * m = <double *> malloc(n * sizeof(double))
+
+    memset(&f, 0, sizeof(Fmm))
+    f.theta = theta
+    f.order = order
+    f.n_mpole = N_TERMS[order - 1]
+    f.n_local = N_TERMS[order]
+    f.x = <double *> malloc(n * sizeof(double))
+    f.y = <double *> malloc(n * sizeof(double))
+    f.z = <double *> malloc(n * sizeof(double))
+    f.m = <double *> malloc(n * sizeof(double))
+    f.acc = <double *> calloc(3 * n, sizeof(double))
+    if x == NULL or y == NULL or z == NULL or m == NULL or \
+            f.x == NULL or f.y == NULL or f.z == NULL or f.m == NULL or f.acc == NULL:
+        ok = -1
+
+    if ok == 0:
+        for i in range(n):
+            x[i] = p_o_pos[i, 0]
+            y[i] = p_o_pos[i, 1]
+            z[i] = p_o_pos[i, 2]
+            m[i] = p_o_masses[i, 0]
+        ok = octree_build(&f.t, x, y, z, m, n, leaf_size)
+
+    if ok == 0:
+        for k in range(n):
+            i = f.t.order[k]
+            f.x[k] = x[i]
+            f.y[k] = y[i]
+            f.z[k] = z[i]
+            f.m[k] = m[i]
+        f.mpole = <double *> malloc(f.n_mpole * f.t.n_nodes * sizeof(double))
+        f.rmax = <double *> malloc(f.t.n_nodes * sizeof(double))
+        f.local = <double *> calloc(f.n_local * f.t.n_nodes, sizeof(double))
+        frontier = <long *> malloc(f.t.n_nodes * sizeof(long))
+        if f.mpole == NULL or f.rmax == NULL or f.local == NULL or frontier == NULL:
+            ok = -1
+
+    if ok == 0:
+        _upward(&f)
+
+        # every subtree of the frontier interacts with the whole tree
+        # (writes only go into the subtree, so this is race free)
+        n_frontier = _frontier(&f, frontier, f.t.n_nodes)
+        for s in prange(n_frontier, schedule='dynamic'):
+            _interact(&f, frontier[s], 0)
+            _downward(&f, frontier[s])
+
+        for k in prange(n, schedule='static'):
+            i = f.t.order[k]
+            for dim in range(3):
+                p_n_accels[i, dim] = f.acc[3 * k + dim]
+                p_n_pos[i, dim] = p_o_pos[i, dim] + delta_t * p_o_speeds[i, dim] + delta_t_sq_half * p_o_accels[i, dim]
+                p_n_speeds[i, dim] = p_o_speeds[i, dim] + f.acc[3 * k + dim] * delta_t
+
+    octree_free(&f.t)
+    free(frontier)
+    free(f.mpole)
+    free(f.rmax)
+    free(f.local)
+    free(f.x)
+    free(f.y)
+    free(f.z)
+    free(f.m)
+    free(f.acc)
+    free(x)
+    free(y)
+    free(z)
+    free(m)
+    return ok
+
+
+include "pingpong.pxi"
+
+
+def move_planets(np.ndarray o_positions,
+                        np.ndarray o_speeds,
+                        np.ndarray o_accels,
+                        np.ndarray o_masses,
+                        np.ndarray n_positions,
+                        np.ndarray n_speeds,
+                        np.ndarray n_accels,
+                        num_planets,
+                        delta_t):
+    """
+    o_* represent old planet data
+    n_* represent the planet data we write into
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :return:
+    """
+
+    move_planets_n(o_positions, o_speeds, o_accels, o_masses,
+                   n_positions, n_speeds, n_accels, num_planets, delta_t, 1)
+
+
+def move_planets_n(np.ndarray o_positions,
+                          np.ndarray o_speeds,
+                          np.ndarray o_accels,
+                          np.ndarray o_masses,
+                          np.ndarray n_positions,
+                          np.ndarray n_speeds,
+                          np.ndarray n_accels,
+                          num_planets,
+                          delta_t,
+                          steps=1,
+                          t_positions=None,
+                          t_speeds=None,
+                          t_accels=None):
+    """
+    Perform steps simulation steps in one call (without the GIL in between)
+    The steps alternate between n_* and internal buffers,
+    only the state after the last step is written into n_*
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :param delta_t:
+    :param steps: number of steps (>= 1)
+    :param t_*: buffers for the intermediate steps (allocated if None)
+    :return:
+    """
+
+    cdef long n = num_planets
+    cdef long k = steps
+    cdef double delta_t_fast = delta_t
+    cdef int ok = 0
+
+    if k < 1:
+        raise ValueError(f"steps must be >= 1, got {steps}")
+
+    # memory views on numpy arrays
+    cdef double [:, :] p_o_pos = o_positions
+    cdef double [:, :] p_o_speeds = o_speeds
+    cdef double [:, :] p_o_accels = o_accels
+    cdef double [:, :] p_o_masses = o_masses
+    cdef double [:, :] p_n_pos = n_positions
+    cdef double [:, :] p_n_speeds = n_speeds
+    cdef double [:, :] p_n_accels = n_accels
+
+    # ping-pong buffers for the intermediate steps
+    if k == 1:
+        t_positions, t_speeds, t_accels = n_positions, n_speeds, n_accels
+    elif t_positions is None:
+        t_positions, t_speeds, t_accels = np.empty_like(n_positions), np.empty_like(n_speeds), np.empty_like(n_accels)
+    cdef double [:, :] p_t_pos = t_positions
+    cdef double [:, :] p_t_speeds = t_speeds
+    cdef double [:, :] p_t_accels = t_accels
+
+    if n == 0:
+        return
+
+    ok = _move_planets_n(p_o_pos, p_o_speeds, p_o_accels, p_o_masses,
+                         p_n_pos, p_n_speeds, p_n_accels,
+                         p_t_pos, p_t_speeds, p_t_accels, n, delta_t_fast, k)
+    if ok != 0:
+        raise MemoryError("could not allocate the octree")
@@ -0,0 +1,199 @@
+"""
+All-pairs update implementation that uses newton's third law
+
+Every pair (i, j) with i < j is only calculated once,
+the force is added to i and subtracted from j.
+Every thread sums up into its own acceleration buffer (length 3n),
+the buffers are added up at the end.
+"""
+
+cimport cython
+from cython.parallel cimport prange, threadid
+cimport openmp
+
+from libc.math cimport sqrt
+from libc.stdlib cimport calloc, free
+
+import numpy as np
+cimport numpy as np
+
+cdef double G = 6.67408e-11
+
+# pos, speeds, accels (see pingpong.pxi)
+ctypedef double real
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _step(double [:, :] p_o_pos,
+               double [:, :] p_o_speeds,
+               double [:, :] p_o_accels,
+               double [:, :] p_o_masses,
+               double [:, :] p_n_pos,
+               double [:, :] p_n_speeds,
+               double [:, :] p_n_accels,
+               long n,
+               double delta_t) noexcept nogil:
+    """
+    One simulation step, o_* -> n_*
+    :return: 0 on success, -1 if out of memory
+    """
+    cdef long i = 0
+    cdef long j = 0
+    cdef long t = 0
+    cdef int dim = 0
+    cdef int num_threads = openmp.omp_get_max_threads()
+    cdef double delta_t_sq_half = (delta_t ** 2) / 2
+
+    # thread _local_ vars
+    cdef double * acc
+    cdef double v0 = 0.0
+    cdef double v1 = 0.0
+    cdef double v2 = 0.0
+    cdef double dist_sq = 0.0
+    cdef double tmp = 0.0
+    cdef double tmp_i = 0.0
+    cdef double tmp_j = 0.0
+    cdef double a0 = 0.0
+    cdef double a1 = 0.0
+    cdef double a2 = 0.0
+    cdef double sum_acc = 0.0
+
+    # one acceleration buffer per thread
+    cdef double * accs = <double *> calloc(num_threads * 3 * n, sizeof(double))
+    if accs == NULL:
+        return -1
+
+    # rows get shorter with growing i, so schedule dynamically
+    for i in prange(n, schedule='dynamic', chunksize=16, num_threads=num_threads):
+        acc = accs + threadid() * 3 * n
+        a0 = 0.0
+        a1 = 0.0
+        a2 = 0.0
+        for j in range(i + 1, n):
+            v0 = p_o_pos[j, 0] - p_o_pos[i, 0]
+            v1 = p_o_pos[j, 1] - p_o_pos[i, 1]
+            v2 = p_o_pos[j, 2] - p_o_pos[i, 2]
+            dist_sq = v0 * v0 + v1 * v1 + v2 * v2
+            tmp = G / (dist_sq * sqrt(dist_sq))
+            tmp_i = tmp * p_o_masses[j, 0]
+            tmp_j = tmp * p_o_masses[i, 0]
+
+            # +F on i, -F on j (divided by the masses)
+            a0 = a0 + tmp_i * v0
+            a1 = a1 + tmp_i * v1
+            a2 = a2 + tmp_i * v2
+            acc[j * 3 + 0] -= tmp_j * v0
+            acc[j * 3 + 1] -= tmp_j * v1
+            acc[j * 3 + 2] -= tmp_j * v2
+        acc[i * 3 + 0] += a0
+        acc[i * 3 + 1] += a1
+        acc[i * 3 + 2] += a2
+
+    # reduce the thread buffers and integrate
+    for i in prange(n, schedule='static', num_threads=num_threads):
+        for dim in range(3):
+            sum_acc = 0.0
+            for t in range(num_threads):
+                sum_acc = sum_acc + accs[t * 3 * n + i * 3 + dim]
+            p_n_accels[i, dim] = sum_acc
+            p_n_pos[i, dim] = p_o_pos[i, dim] + delta_t * p_o_speeds[i, dim] + delta_t_sq_half * p_o_accels[i, dim]
+            p_n_speeds[i, dim] = p_o_speeds[i, dim] + sum_acc * delta_t
+
+    free(accs)
+    return 0
+
+
+include "pingpong.pxi"
+
+
+def move_planets(np.ndarray o_positions,
+                        np.ndarray o_speeds,
+                        np.ndarray o_accels,
+                        np.ndarray o_masses,
+                        np.ndarray n_positions,
+                        np.ndarray n_speeds,
+                        np.ndarray n_accels,
+                        num_planets,
+                        delta_t):
+    """
+    o_* represent old planet data
+    n_* represent the planet data we write into
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :return:
+    """
+
+    move_planets_n(o_positions, o_speeds, o_accels, o_masses,
+                   n_positions, n_speeds, n_accels, num_planets, delta_t, 1)
+
+
+def move_planets_n(np.ndarray o_positions,
+                          np.ndarray o_speeds,
+                          np.ndarray o_accels,
+                          np.ndarray o_masses,
+                          np.ndarray n_positions,
+                          np.ndarray n_speeds,
+                          np.ndarray n_accels,
+                          num_planets,
+                          delta_t,
+                          steps=1,
+                          t_positions=None,
+                          t_speeds=None,
+                          t_accels=None):
+    """
+    Perform steps simulation steps in one call (without the GIL in between)
+    The steps alternate between n_* and internal buffers,
+    only the state after the last step is written into n_*
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :param delta_t:
+    :param steps: number of steps (>= 1)
+    :param t_*: buffers for the intermediate steps (allocated if None)
+    :return:
+    """
+
+    cdef long n = num_planets
+    cdef long k = steps
+    cdef double delta_t_fast = delta_t
+    cdef int ok = 0
+
+    if k < 1:
+        raise ValueError(f"steps must be >= 1, got {steps}")
+
+    # memory views on numpy arrays
+    cdef double [:, :] p_o_pos = o_positions
+    cdef double [:, :] p_o_speeds = o_speeds
+    cdef double [:, :] p_o_accels = o_accels
+    cdef double [:, :] p_o_masses = o_masses
+    cdef double [:, :] p_n_pos = n_positions
+    cdef double [:, :] p_n_speeds = n_speeds
+    cdef double [:, :] p_n_accels = n_accels
+
+    # ping-pong buffers for the intermediate steps
+    if k == 1:
+        t_positions, t_speeds, t_accels = n_positions, n_speeds, n_accels
+    elif t_positions is None:
+        t_positions, t_speeds, t_accels = np.empty_like(n_positions), np.empty_like(n_speeds), np.empty_like(n_accels)
+    cdef double [:, :] p_t_pos = t_positions
+    cdef double [:, :] p_t_speeds = t_speeds
+    cdef double [:, :] p_t_accels = t_accels
+
+    ok = _move_planets_n(p_o_pos, p_o_speeds, p_o_accels, p_o_masses,
+                         p_n_pos, p_n_speeds, p_n_accels,
+                         p_t_pos, p_t_speeds, p_t_accels, n, delta_t_fast, k)
+    if ok != 0:
+        raise MemoryError("could not allocate the acceleration buffers")
@@ -0,0 +1,264 @@
+"""
+Cache blocked all-pairs update implementation
+
+The positions and masses are copied into separate x / y / z / m arrays (SoA).
+The bodies j are walked in tiles that fit into the L1 cache
+while a block of bodies i is summed up against them.
+
+The inner loop has no branch (the self interaction is masked out)
+and no division by |r|^3 (1 / sqrt(r^2) is calculated once and multiplied),
+so gcc can auto-vectorize it (-O3 -march=native -ffast-math).
+
+Supports float32 planets (precision "float32" in the config):
+the positions are scaled by the size of the system and G / size^2 is folded
+into the masses (no under- / overflow in single precision),
+one tile is summed up in the planets' precision, the sums over all tiles
+are done in double precision.
+"""
+
+cimport cython
+from cython.parallel cimport prange
+
+from libc.math cimport sqrt, sqrtf, fabs
+from libc.stdlib cimport malloc, free
+
+import numpy as np
+cimport numpy as np
+
+cdef double G = 6.67408e-11
+
+# precisions of pos, speeds, accels this implementation can work on
+PRECISIONS = ("float64", "float32")
+
+ctypedef fused real:
+    float
+    double
+
+# bodies j per tile: 4 arrays * 8 byte * 512 = 16KiB (half of a typical L1, float64)
+# bodies i per block: one block is the unit of work of one thread
+cdef enum:
+    TILE_J = 512
+    BLOCK_I = 64
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _accel_block(real * x, real * y, real * z, real * m,
+                       double * ax, double * ay, double * az,
+                       long i_from, long i_to, long n) noexcept nogil:
+    """
+    Accelerations of the bodies [i_from, i_to) caused by all n bodies
+    (x, y, z scaled by the system size, m scaled by G / size^2)
+    """
+    cdef long jt = 0
+    cdef long j_to = 0
+    cdef long i = 0
+    cdef long j = 0
+    cdef real xi = 0.0
+    cdef real yi = 0.0
+    cdef real zi = 0.0
+    cdef real a0 = 0.0
+    cdef real a1 = 0.0
+    cdef real a2 = 0.0
+    cdef real v0 = 0.0
+    cdef real v1 = 0.0
+    cdef real v2 = 0.0
+    cdef real dist_sq = 0.0
+    cdef real inv_dist = 0.0
+    cdef real tmp = 0.0
+
+    for i in range(i_from, i_to):
+        ax[i] = 0.0
+        ay[i] = 0.0
+        az[i] = 0.0
+
+    jt = 0
+    while jt < n:
+        j_to = jt + TILE_J if jt + TILE_J < n else n
+        for i in range(i_from, i_to):
+            xi = x[i]
+            yi = y[i]
+            zi = z[i]
+            a0 = 0.0
+            a1 = 0.0
+            a2 = 0.0
+
+            # branch free: dist_sq == 0 (i == j) adds 1 under the root
+            # and is multiplied by 0 afterwards
+            for j in range(jt, j_to):
+                v0 = x[j] - xi
+                v1 = y[j] - yi
+                v2 = z[j] - zi
+                dist_sq = v0 * v0 + v1 * v1 + v2 * v2
+                if real is float:
+                    inv_dist = 1 / sqrtf(dist_sq + (dist_sq == 0))
+                else:
+                    inv_dist = 1 / sqrt(dist_sq + (dist_sq == 0))
+                tmp = m[j] * inv_dist * inv_dist * inv_dist * (dist_sq != 0)
+                a0 += tmp * v0
+                a1 += tmp * v1
+                a2 += tmp * v2
+
+            ax[i] += a0
+            ay[i] += a1
+            az[i] += a2
+        jt = j_to
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _step(real [:, :] p_o_pos,
+               real [:, :] p_o_speeds,
+               real [:, :] p_o_accels,
+               double [:, :] p_o_masses,
+               real [:, :] p_n_pos,
+               real [:, :] p_n_speeds,
+               real [:, :] p_n_accels,
+               long n,
+               double delta_t) noexcept nogil:
+    """
+    One simulation step, o_* -> n_*
+    :return: 0 on success, -1 if out of memory
+    """
+    cdef long i = 0
+    cdef long b = 0
+    cdef long i_to = 0
+    cdef long blocks = (n + BLOCK_I - 1) // BLOCK_I
+    cdef double delta_t_sq_half = (delta_t ** 2) / 2
+    cdef double size = 0.0
+    cdef double mass_scale = 0.0
+
+    # x, y, z, m in the planets' precision, ax, ay, az in double
+    cdef real * pos = <real *> malloc(4 * n * sizeof(real))
+    cdef real * x = pos
+    cdef real * y = pos + n
+    cdef real * z = pos + 2 * n
+    cdef real * m = pos + 3 * n
+    cdef double * soa = <double *> malloc(3 * n * sizeof(double))
+    cdef double * ax = soa
+    cdef double * ay = soa + n
+    cdef double * az = soa + 2 * n
+
+    if pos == NULL or soa == NULL:
+        free(pos)
+        free(soa)
+        return -1
+
+    for i in range(n):
+        size = fabs(p_o_pos[i, 0]) if fabs(p_o_pos[i, 0]) > size else size
+        size = fabs(p_o_pos[i, 1]) if fabs(p_o_pos[i, 1]) > size else size
+        size = fabs(p_o_pos[i, 2]) if fabs(p_o_pos[i, 2]) > size else size
+    size = size if size > 0 else 1.0
+    mass_scale = G / (size * size)
+
+    for i in range(n):
+        x[i] = <real> (p_o_pos[i, 0] / size)
+        y[i] = <real> (p_o_pos[i, 1] / size)
+        z[i] = <real> (p_o_pos[i, 2] / size)
+        m[i] = <real> (p_o_masses[i, 0] * mass_scale)
+
+    for b in prange(blocks, schedule='static'):
+        i_to = (b + 1) * BLOCK_I if (b + 1) * BLOCK_I < n else n
+        _accel_block(x, y, z, m, ax, ay, az, b * BLOCK_I, i_to, n)
+
+    for i in prange(n, schedule='static'):
+        p_n_accels[i, 0] = ax[i]
+        p_n_accels[i, 1] = ay[i]
+        p_n_accels[i, 2] = az[i]
+        p_n_pos[i, 0] = p_o_pos[i, 0] + delta_t * p_o_speeds[i, 0] + delta_t_sq_half * p_o_accels[i, 0]
+        p_n_pos[i, 1] = p_o_pos[i, 1] + delta_t * p_o_speeds[i, 1] + delta_t_sq_half * p_o_accels[i, 1]
+        p_n_pos[i, 2] = p_o_pos[i, 2] + delta_t * p_o_speeds[i, 2] + delta_t_sq_half * p_o_accels[i, 2]
+        p_n_speeds[i, 0] = p_o_speeds[i, 0] + ax[i] * delta_t
+        p_n_speeds[i, 1] = p_o_speeds[i, 1] + ay[i] * delta_t
+        p_n_speeds[i, 2] = p_o_speeds[i, 2] + az[i] * delta_t
+
+    free(pos)
+    free(soa)
+    return 0
+
+
+include "pingpong.pxi"
+
+
+def move_planets(np.ndarray o_positions,
+                        np.ndarray o_speeds,
+                        np.ndarray o_accels,
+                        np.ndarray o_masses,
+                        np.ndarray n_positions,
+                        np.ndarray n_speeds,
+                        np.ndarray n_accels,
+                        num_planets,
+                        delta_t):
+    """
+    o_* represent old planet data
+    n_* represent the planet data we write into
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :return:
+    """
+
+    move_planets_n(o_positions, o_speeds, o_accels, o_masses,
+                   n_positions, n_speeds, n_accels, num_planets, delta_t, 1)
+
+
+def move_planets_n(np.ndarray o_positions,
+                          np.ndarray o_speeds,
+                          np.ndarray o_accels,
+                          np.ndarray o_masses,
+                          np.ndarray n_positions,
+                          np.ndarray n_speeds,
+                          np.ndarray n_accels,
+                          num_planets,
+                          delta_t,
+                          steps=1,
+                          t_positions=None,
+                          t_speeds=None,
+                          t_accels=None):
+    """
+    Perform steps simulation steps in one call (without the GIL in between)
+    The steps alternate between n_* and internal buffers,
+    only the state after the last step is written into n_*
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :param delta_t:
+    :param steps: number of steps (>= 1)
+    :param t_*: buffers for the intermediate steps (allocated if None)
+    :return:
+    """
+
+    cdef int ok = 0
+    cdef long k = steps
+
+    if k < 1:
+        raise ValueError(f"steps must be >= 1, got {steps}")
+
+    # ping-pong buffers for the intermediate steps
+    if k == 1:
+        t_positions, t_speeds, t_accels = n_positions, n_speeds, n_accels
+    elif t_positions is None:
+        t_positions, t_speeds, t_accels = np.empty_like(n_positions), np.empty_like(n_speeds), np.empty_like(n_accels)
+
+    if o_positions.dtype == np.float32:
+        ok = _move_planets_n[float](o_positions, o_speeds, o_accels, o_masses,
+                                    n_positions, n_speeds, n_accels,
+                                    t_positions, t_speeds, t_accels, num_planets, delta_t, k)
+    else:
+        ok = _move_planets_n[double](o_positions, o_speeds, o_accels, o_masses,
+                                     n_positions, n_speeds, n_accels,
+                                     t_positions, t_speeds, t_accels, num_planets, delta_t, k)
+    if ok != 0:
+        raise MemoryError("could not allocate the SoA buffers")
@@ -0,0 +1,216 @@
+# octree shared by the tree based update implementations
+# (cyworker_barneshut, cyworker_fmm)
+#
+# usage: include "octree.pxi"
+#
+# the tree is stored as a flat array of nodes, the bodies of a node are
+# the contiguous range [start, start + count) of the permutation t.order
+# (this way the bodies of a leaf lie next to each other in memory)
+
+from libc.stdlib cimport malloc, calloc, realloc, free
+
+# deeper than this we stop splitting (coincident bodies)
+cdef enum:
+    OCTREE_MAX_DEPTH = 48
+
+
+cdef struct Node:
+    # geometric center and half edge length of the cube
+    double cx
+    double cy
+    double cz
+    double half
+
+    # center of mass and mass
+    double mx
+    double my
+    double mz
+    double mass
+
+    # bodies in t.order[start:start + count]
+    long start
+    long count
+
+    # index into t.nodes, -1 if empty
+    long child[8]
+    int leaf
+
+
+cdef struct Octree:
+    Node * nodes
+    long n_nodes
+    long capacity
+    long leaf_size
+
+    # permutation of body indices (tree order)
+    long * order
+    long * tmp
+
+
+cdef long _octree_new_node(Octree * t) noexcept nogil:
+    """
+    Return the index of a fresh node, grows the node pool if needed.
+    Returns -1 if we are out of memory
+    """
+    cdef Node * grown
+    if t.n_nodes == t.capacity:
+        grown = <Node *> realloc(t.nodes, 2 * t.capacity * sizeof(Node))
+        if grown == NULL:
+            return -1
+        t.nodes = grown
+        t.capacity = 2 * t.capacity
+    t.n_nodes += 1
+    return t.n_nodes - 1
+
+
+cdef long _octree_build_node(Octree * t, double * x, double * y, double * z, double * m,
+                             long start, long count,
+                             double cx, double cy, double cz, double half,
+                             int depth) noexcept nogil:
+    """
+    Recursively build the node containing t.order[start:start + count]
+    :return: index of the node or -1 (out of memory)
+    """
+    cdef long idx = _octree_new_node(t)
+    cdef long k = 0
+    cdef long j = 0
+    cdef long c = 0
+    cdef int o = 0
+    cdef long counts[8]
+    cdef long offsets[8]
+    cdef double q = half / 2
+    cdef double mass = 0.0
+    cdef double mx = 0.0
+    cdef double my = 0.0
+    cdef double mz = 0.0
+
+    if idx < 0:
+        return -1
+
+    t.nodes[idx].cx = cx
+    t.nodes[idx].cy = cy
+    t.nodes[idx].cz = cz
+    t.nodes[idx].half = half
+    t.nodes[idx].start = start
+    t.nodes[idx].count = count
+    for o in range(8):
+        t.nodes[idx].child[o] = -1
+
+    if count <= t.leaf_size or depth >= OCTREE_MAX_DEPTH:
+
+        # leaf: sum up the bodies directly
+        t.nodes[idx].leaf = 1
+        for k in range(start, start + count):
+            j = t.order[k]
+            mass += m[j]
+            mx += m[j] * x[j]
+            my += m[j] * y[j]
+            mz += m[j] * z[j]
+
+    else:
+
+        # counting sort of the bodies into the 8 octants
+        t.nodes[idx].leaf = 0
+        for o in range(8):
+            counts[o] = 0
+        for k in range(start, start + count):
+            j = t.order[k]
+            o = (x[j] > cx) | ((y[j] > cy) << 1) | ((z[j] > cz) << 2)
+            counts[o] += 1
+        offsets[0] = start
+        for o in range(1, 8):
+            offsets[o] = offsets[o - 1] + counts[o - 1]
+        for k in range(start, start + count):
+            j = t.order[k]
+            o = (x[j] > cx) | ((y[j] > cy) << 1) | ((z[j] > cz) << 2)
+            t.tmp[offsets[o]] = j
+            offsets[o] += 1
+        for k in range(start, start + count):
+            t.order[k] = t.tmp[k]
+
+        # build children (t.nodes may move while doing so)
+        c = start
+        for o in range(8):
+            if counts[o] > 0:
+                j = _octree_build_node(t, x, y, z, m, c, counts[o],
+                                       cx + (q if o & 1 else -q),
+                                       cy + (q if o & 2 else -q),
+                                       cz + (q if o & 4 else -q),
+                                       q, depth + 1)
+                if j < 0:
+                    return -1
+                t.nodes[idx].child[o] = j
+                mass += t.nodes[j].mass
+                mx += t.nodes[j].mass * t.nodes[j].mx
+                my += t.nodes[j].mass * t.nodes[j].my
+                mz += t.nodes[j].mass * t.nodes[j].mz
+                c += counts[o]
+
+    t.nodes[idx].mass = mass
+    if mass != 0.0:
+        t.nodes[idx].mx = mx / mass
+        t.nodes[idx].my = my / mass
+        t.nodes[idx].mz = mz / mass
+    else:
+        t.nodes[idx].mx = cx
+        t.nodes[idx].my = cy
+        t.nodes[idx].mz = cz
+
+    return idx
+
+
+cdef int octree_build(Octree * t, double * x, double * y, double * z, double * m,
+                      long n, long leaf_size) noexcept nogil:
+    """
+    Build an octree over the bodies (x, y, z, m are SoA arrays of length n)
+    The root node has index 0.
+    :return: 0 on success, -1 if out of memory
+    """
+    cdef long i = 0
+    cdef double x_min = x[0]
+    cdef double x_max = x[0]
+    cdef double y_min = y[0]
+    cdef double y_max = y[0]
+    cdef double z_min = z[0]
+    cdef double z_max = z[0]
+    cdef double half = 0.0
+
+    t.leaf_size = leaf_size if leaf_size > 0 else 1
+    t.n_nodes = 0
+    t.capacity = 2 * (n // t.leaf_size) + 64
+    t.nodes = <Node *> malloc(t.capacity * sizeof(Node))
+    t.order = <long *> malloc(n * sizeof(long))
+    t.tmp = <long *> malloc(n * sizeof(long))
+    if t.nodes == NULL or t.order == NULL or t.tmp == NULL:
+        return -1
+
+    # bounding cube
+    for i in range(n):
+        t.order[i] = i
+        x_min = x[i] if x[i] < x_min else x_min
+        x_max = x[i] if x[i] > x_max else x_max
+        y_min = y[i] if y[i] < y_min else y_min
+        y_max = y[i] if y[i] > y_max else y_max
+        z_min = z[i] if z[i] < z_min else z_min
+        z_max = z[i] if z[i] > z_max else z_max
+    half = x_max - x_min
+    half = y_max - y_min if y_max - y_min > half else half
+    half = z_max - z_min if z_max - z_min > half else half
+    half = half / 2 * (1 + 1e-9)
+
+    if _octree_build_node(t, x, y, z, m, 0, n,
+                          (x_min + x_max) / 2, (y_min + y_max) / 2, (z_min + z_max) / 2,
+                          half, 0) < 0:
+        return -1
+    return 0
+
+
+cdef void octree_free(Octree * t) noexcept nogil:
+    free(t.nodes)
+    free(t.order)
+    free(t.tmp)
+    t.nodes = NULL
+    t.order = NULL
+    t.tmp = NULL
+    t.n_nodes = 0
+    t.capacity = 0
@@ -0,0 +1,56 @@
+# k simulation steps in one call, shared by the update implementations
+# with move_planets_n (cyworker_parallel, cyworker_symmetric, cyworker_tiled,
+# cyworker_barneshut, cyworker_fmm)
+#
+# usage: include "pingpong.pxi" after the definition of
+#
+#   real: the float type of pos, speeds, accels (a fused type or ctypedef double real)
+#   cdef int _step(real [:, :] p_o_pos, real [:, :] p_o_speeds, real [:, :] p_o_accels,
+#                  double [:, :] p_o_masses,
+#                  real [:, :] p_n_pos, real [:, :] p_n_speeds, real [:, :] p_n_accels,
+#                  long n, double delta_t) noexcept nogil
+#       one simulation step o_* -> n_*, 0 on success
+
+
+cdef int _move_planets_n(real [:, :] p_o_pos,
+                         real [:, :] p_o_speeds,
+                         real [:, :] p_o_accels,
+                         double [:, :] p_o_masses,
+                         real [:, :] p_n_pos,
+                         real [:, :] p_n_speeds,
+                         real [:, :] p_n_accels,
+                         real [:, :] p_t_pos,
+                         real [:, :] p_t_speeds,
+                         real [:, :] p_t_accels,
+                         long n,
+                         double delta_t,
+                         long k):
+    """
+    k steps without the GIL, alternating between n_* and t_*, the last one ends up in n_*
+    :return: 0 on success, the result of the failed _step otherwise
+    """
+    cdef int ok = 0
+    cdef long s = 0
+    with nogil:
+        for s in range(k):
+            if (k - s) % 2 == 1:
+                if s == 0:
+                    ok = _step(p_o_pos, p_o_speeds, p_o_accels, p_o_masses,
+                               p_n_pos, p_n_speeds, p_n_accels,
+                               n, delta_t)
+                else:
+                    ok = _step(p_t_pos, p_t_speeds, p_t_accels, p_o_masses,
+                               p_n_pos, p_n_speeds, p_n_accels,
+                               n, delta_t)
+            else:
+                if s == 0:
+                    ok = _step(p_o_pos, p_o_speeds, p_o_accels, p_o_masses,
+                               p_t_pos, p_t_speeds, p_t_accels,
+                               n, delta_t)
+                else:
+                    ok = _step(p_n_pos, p_n_speeds, p_n_accels, p_o_masses,
+                               p_t_pos, p_t_speeds, p_t_accels,
+                               n, delta_t)
+            if ok != 0:
+                break
+    return ok
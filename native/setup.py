@@ -31,6 +31,26 @@ ext_modules=[
               extra_link_args=["-fopenmp"],
               include_dirs=[numpy.get_include()]),
     Extension("cyworker", ["cyworker.pyx"],
+              extra_compile_args=['-O3', '-fopenmp'], libraries=['m'],
+              extra_link_args=["-fopenmp"],
+              include_dirs=[numpy.get_include()]),
+    Extension("cyworker_barneshut", ["cyworker_barneshut.pyx"],
+              extra_compile_args=['-O3', '-fopenmp'], libraries=['m'],
+              extra_link_args=["-fopenmp"],
+              include_dirs=[numpy.get_include()]),
+    Extension("cyworker_fmm", ["cyworker_fmm.pyx"],
+              extra_compile_args=['-O3', '-fopenmp'], libraries=['m'],
+              extra_link_args=["-fopenmp"],
+              include_dirs=[numpy.get_include()]),
+    Extension("cyworker_symmetric", ["cyworker_symmetric.pyx"],
+              extra_compile_args=['-O3', '-fopenmp'], libraries=['m'],
+              extra_link_args=["-fopenmp"],
+              include_dirs=[numpy.get_include()]),
+    Extension("cyworker_tiled", ["cyworker_tiled.pyx"],
+              extra_compile_args=['-O3', '-march=native', '-ffast-math', '-fopenmp'], libraries=['m'],
+              extra_link_args=["-fopenmp"],
+              include_dirs=[numpy.get_include()]),
+    Extension("cyenergy", ["cyenergy.pyx"],
               extra_compile_args=['-O3', '-fopenmp'], libraries=['m'],
               extra_link_args=["-fopenmp"],
               include_dirs=[numpy.get_include()])
@@ -0,0 +1,172 @@
+"""
+Pure NumPy all-pairs update implementation (no compiler needed)
+
+The pairwise differences are calculated with broadcasting,
+one block of rows i against all n bodies j at a time,
+so the temporary arrays stay at O(BLOCK_ELEMENTS) instead of O(n^2).
+"""
+
+import numpy as np
+
+G = 6.67408e-11
+
+# max. number of pairs (rows * n) per block: 2^18 doubles = 2MiB per temporary
+BLOCK_ELEMENTS = 1 << 18
+
+
+def _accels(o_positions, o_masses, i_from, i_to, out):
+    """
+    Accelerations of the bodies [i_from, i_to) caused by all bodies
+    :param o_positions: (n, 3)
+    :param o_masses: (n, 1)
+    :param i_from: inclusive
+    :param i_to: exclusive
+    :param out: (i_to - i_from, 3), the accelerations are written into it
+    :return: out
+    """
+
+    n = len(o_positions)
+    x = o_positions[:, 0]
+    y = o_positions[:, 1]
+    z = o_positions[:, 2]
+    m = o_masses[:, 0]
+    rows = max(1, BLOCK_ELEMENTS // max(n, 1))
+
+    for b_from in range(i_from, i_to, rows):
+        b_to = min(b_from + rows, i_to)
+        b = b_to - b_from
+
+        # (b, n) differences x_j - x_i
+        dx = x[np.newaxis, :] - x[b_from:b_to, np.newaxis]
+        dy = y[np.newaxis, :] - y[b_from:b_to, np.newaxis]
+        dz = z[np.newaxis, :] - z[b_from:b_to, np.newaxis]
+
+        # w = m_j / |r|^3, in place to avoid more temporaries
+        w = dx * dx
+        w += dy * dy
+        w += dz * dz
+
+        # no self interaction: r^2 = inf -> w = 0
+        w[np.arange(b), np.arange(b_from, b_to)] = np.inf
+        r = np.sqrt(w)
+        w *= r
+        np.divide(m, w, out=w)
+
+        o = out[b_from - i_from:b_to - i_from]
+        o[:, 0] = np.einsum('ij,ij->i', w, dx)
+        o[:, 1] = np.einsum('ij,ij->i', w, dy)
+        o[:, 2] = np.einsum('ij,ij->i', w, dz)
+
+    out *= G
+    return out
+
+
+def move_planets(o_positions,
+                        o_speeds,
+                        o_accels,
+                        o_masses,
+                        n_positions,
+                        n_speeds,
+                        n_accels,
+                        num_planets,
+                        delta_t):
+    """
+    o_* represent old planet data
+    n_* represent the planet data we write into
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :return:
+    """
+
+    delta_sq_half = ((delta_t ** 2) / 2)
+
+    _accels(o_positions, o_masses, 0, num_planets, n_accels)
+    n_positions[:] = o_positions + delta_t * o_speeds + delta_sq_half * o_accels
+    n_speeds[:] = o_speeds + n_accels * delta_t
+
+
+def update_planet_indices(o_positions,
+                          o_speeds,
+                          o_accels,
+                          o_masses,
+                          num_planets,
+                          i_from,
+                          i_to,
+                          delta_t):
+    """
+    Same as native.cyworker.update_planet_indices (used by the distributed worker)
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param num_planets:
+    :param i_from: inclusive
+    :param i_to:   exclusive
+    :param delta_t:
+    :return: (r_pos, r_speeds, r_accels)
+    """
+
+    delta_sq_half = ((delta_t ** 2) / 2)
+
+    r_accels = np.empty((i_to - i_from, 3), dtype=np.float64)
+    _accels(o_positions, o_masses, i_from, i_to, r_accels)
+    r_pos = o_positions[i_from:i_to] + delta_t * o_speeds[i_from:i_to] + delta_sq_half * o_accels[i_from:i_to]
+    r_speeds = o_speeds[i_from:i_to] + r_accels * delta_t
+
+    return r_pos, r_speeds, r_accels
+
+
+def move_planets_n(o_positions,
+                          o_speeds,
+                          o_accels,
+                          o_masses,
+                          n_positions,
+                          n_speeds,
+                          n_accels,
+                          num_planets,
+                          delta_t,
+                          steps=1,
+                          t_positions=None,
+                          t_speeds=None,
+                          t_accels=None):
+    """
+    Perform steps simulation steps in one call
+    The steps alternate between n_* and internal buffers,
+    only the state after the last step is written into n_*
+    :param o_positions:
+    :param o_speeds:
+    :param o_accels:
+    :param o_masses:
+    :param n_positions:
+    :param n_speeds:
+    :param n_accels:
+    :param num_planets:
+    :param delta_t:
+    :param steps: number of steps (>= 1)
+    :param t_*: buffers for the intermediate steps (allocated if None)
+    :return:
+    """
+
+    if steps < 1:
+        raise ValueError(f"steps must be >= 1, got {steps}")
+
+    new = (n_positions, n_speeds, n_accels)
+    if steps == 1:
+        tmp = new
+    elif t_positions is None:
+        tmp = tuple(np.empty_like(a) for a in new)
+    else:
+        tmp = (t_positions, t_speeds, t_accels)
+    src = (o_positions, o_speeds, o_accels)
+
+    for s in range(steps):
+        # the last step has to end up in n_*
+        dst = new if (steps - s) % 2 == 1 else tmp
+        move_planets(src[0], src[1], src[2], o_masses, dst[0], dst[1], dst[2], num_planets, delta_t)
+        src = dst
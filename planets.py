@@ -1,16 +1,50 @@
 import numpy as np
 
-from lib.helper import valueMap
 
 class Planets:
-    def __init__(self, num_planets):
+    def __init__(self, num_planets, dtype=np.float64):
+        """
+        :param num_planets:
+        :param dtype: precision of pos, speeds and accels (np.float64 or np.float32)
+                      masses and radii are always float64
+                      (m_i * m_j does not fit into a float32)
+        """
         self.n      = num_planets
-        self.pos    = np.empty((num_planets, 3), dtype=np.float64)
-        self.speeds = np.empty((num_planets, 3), dtype=np.float64)
-        self.accels = np.zeros((num_planets, 3), dtype=np.float64)
+        self.dtype  = np.dtype(dtype)
+        self.pos    = np.empty((num_planets, 3), dtype=self.dtype)
+        self.speeds = np.empty((num_planets, 3), dtype=self.dtype)
+        self.accels = np.zeros((num_planets, 3), dtype=self.dtype)
         self.masses = np.empty((num_planets, 1), dtype=np.float64)
         self.radii  = np.empty((num_planets, 1), dtype=np.float64)
         self.names  = ["unknown" for _ in range(num_planets)]
+        self._alloc_buffers()
+
+    def _alloc_buffers(self):
+        """
+        (re)allocate the back buffers (new_*) the update implementation writes into
+        masses, radii and names never change, so they are not double buffered
+        """
+        self.new_pos    = np.empty_like(self.pos)
+        self.new_speeds = np.empty_like(self.speeds)
+        self.new_accels = np.empty_like(self.accels)
+        self._scratch   = None
+
+    def swap(self):
+        """
+        make the back buffers (new_*) the current state, no copying
+        """
+        self.pos, self.new_pos = self.new_pos, self.pos
+        self.speeds, self.new_speeds = self.new_speeds, self.speeds
+        self.accels, self.new_accels = self.new_accels, self.accels
+
+    def scratch(self):
+        """
+        third set of (pos, speeds, accels) buffers for the intermediate steps
+        of move_planets_n, allocated on first use
+        """
+        if self._scratch is None:
+            self._scratch = (np.empty_like(self.pos), np.empty_like(self.speeds), np.empty_like(self.accels))
+        return self._scratch
 
     def serialize(self):
         d = dict()
@@ -28,53 +62,38 @@ class Planets:
     def deserialize(self, d: dict):
         #print("deserialize(), d:", d)
         self.n = d["n"]
-        self.pos = np.array(d["pos"], dtype=np.float64)
-        self.speeds = np.array(d["speeds"], dtype=np.float64)
-        self.accels = np.array(d["accels"], dtype=np.float64)
+        self.pos = np.array(d["pos"], dtype=self.dtype)
+        self.speeds = np.array(d["speeds"], dtype=self.dtype)
+        self.accels = np.array(d["accels"], dtype=self.dtype)
         self.masses = np.array(d["masses"], dtype=np.float64)
         self.radii = np.array(d["radii"], dtype=np.float64)
         self.names = d["names"]
+        self._alloc_buffers()
         return self
 
-    #@jit
     def pos_to_renderable_numpy_array(self, scale_world, scale_planet=np.array((1))):
         """
         structure : [x,y,z,scale]
-        :return: a numpy array representing the renderable part of this planet
+        x, y, z are mapped from [-scale_world, scale_world] to [-1, 1] (for opengl),
+        planets out of bounds get scale 0 (hidden by the renderer),
+        so row i is always planet i (needed for interpolating between frames)
+        :return: a contiguous float32 numpy array (n, 4) representing the renderable part of the planets
         """
 
-        # TODO use copy / reference here?
-
-        l = []
-        for i in range(self.n):
-
-            pos_with_scale = np.empty((4), dtype=np.float64)
-            pos_with_scale[0] = self.pos[i][0]
-            pos_with_scale[1] = self.pos[i][1]
-            pos_with_scale[2] = self.pos[i][2]
-
-            # scale x (for opengl)
-            pos_with_scale[0] = valueMap(pos_with_scale[0], -scale_world, scale_world, -1, 1)
-
-            # scale y
-            pos_with_scale[1] = valueMap(pos_with_scale[1], -scale_world, scale_world, -1, 1)
-
-            # scale z
-            pos_with_scale[2] = valueMap(pos_with_scale[2], -scale_world, scale_world, -1, 1)
+        renderable = np.empty((self.n, 4), dtype=np.float32)
 
-            # add scale
-            pos_with_scale[3] = self.radii[i] * scale_planet
+        # valueMap(x, -scale_world, scale_world, -1, 1) == x / scale_world
+        np.divide(self.pos, scale_world, out=renderable[:, :3], casting="unsafe")
 
-            # append to planets list (only if planet isn't out of bounds)
-            if (pos_with_scale[0] > -1.0 and pos_with_scale[0] < 1.0) and \
-                (pos_with_scale[1] > -1.0 and pos_with_scale[1] < 1.0) and \
-                (pos_with_scale[2] > -1.0 and pos_with_scale[2] < 1.0):
-                l.append(pos_with_scale.tolist())
+        # add scale
+        np.multiply(self.radii[:, 0], scale_planet, out=renderable[:, 3], casting="unsafe")
 
-        return l
+        # hide planets outside the (-1, 1) cube
+        renderable[:, 3] *= np.all(np.abs(renderable[:, :3]) < 1.0, axis=1)
+        return renderable
 
     def __deepcopy__(self, memodict={}):
-        planets = Planets(self.n)
+        planets = Planets(self.n, self.dtype)
         planets.pos      = np.copy(self.pos)
         planets.speeds   = np.copy(self.speeds)
         planets.accels   = np.copy(self.accels)
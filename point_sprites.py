@@ -0,0 +1,133 @@
+"""
+Draw all bodies with one draw call: shaded point sprites
+"""
+#
+# The bodies ([x, y, z, scale] float32) are uploaded into one vertex buffer
+# per frame and drawn with a single glDrawArrays(GL_POINTS).
+# The vertex shader sizes every point like a sphere of radius scale
+# under the current projection, the fragment shader cuts out a disc
+# and shades it like a lit sphere.
+#
+# Only needs OpenGL 2.0 / GLSL 1.20 (compatibility profile),
+# so it also runs on Mesa's software rasterizer (llvmpipe).
+
+import ctypes
+import sys
+from math import radians, tan
+
+try:
+    from OpenGL import GL
+    from OpenGL.GL import shaders
+except ImportError:
+    print('Error: PyOpenGL not installed properly !!')
+    sys.exit()
+
+
+_VERTEX_SHADER = """
+#version 120
+
+// gl_Vertex: x, y, z, radius
+uniform float point_scale;
+uniform vec3 light_position;
+
+varying vec3 light_dir;
+
+void main()
+{
+    vec4 eye = gl_ModelViewMatrix * vec4(gl_Vertex.xyz, 1.0);
+    gl_Position = gl_ProjectionMatrix * eye;
+
+    // hidden bodies (radius 0): outside of the clip volume
+    if (gl_Vertex.w <= 0.0) {
+        gl_Position = vec4(2.0, 2.0, 2.0, 1.0);
+    }
+
+    // projected diameter in pixels, at least one pixel
+    gl_PointSize = max(2.0 * gl_Vertex.w * point_scale / max(-eye.z, 1e-6), 1.0);
+
+    light_dir = normalize(light_position - eye.xyz);
+}
+"""
+
+_FRAGMENT_SHADER = """
+#version 120
+
+uniform vec3 ambient;
+uniform vec3 diffuse;
+
+varying vec3 light_dir;
+
+void main()
+{
+    // position on the disc, -1 .. 1
+    vec2 p = gl_PointCoord * 2.0 - 1.0;
+    p.y = -p.y;
+    float d = dot(p, p);
+    if (d > 1.0) {
+        discard;
+    }
+
+    // normal of the sphere at that point (facing the camera)
+    vec3 normal = vec3(p, sqrt(1.0 - d));
+    float lambert = max(dot(normal, light_dir), 0.0);
+    gl_FragColor = vec4(ambient + diffuse * lambert, 1.0);
+}
+"""
+
+# bytes per body: 4 float32
+_STRIDE = 16
+
+
+class PointSprites:
+    """
+    Vertex buffer + shader program for drawing the bodies as point sprites.
+    Raises an exception in __init__ if the shaders are not supported.
+    The default colors are the light * material colors of the sphere path.
+    """
+    def __init__(self, light_position, ambient=(0.2, 0.2, 0.2), diffuse=(0.7, 0.7, 1.4)):
+        self.program = shaders.compileProgram(
+            shaders.compileShader(_VERTEX_SHADER, GL.GL_VERTEX_SHADER),
+            shaders.compileShader(_FRAGMENT_SHADER, GL.GL_FRAGMENT_SHADER))
+        self.vbo = GL.glGenBuffers(1)
+        self.capacity = 0
+
+        self.u_point_scale = GL.glGetUniformLocation(self.program, "point_scale")
+        GL.glUseProgram(self.program)
+        GL.glUniform3f(GL.glGetUniformLocation(self.program, "light_position"), *light_position)
+        GL.glUniform3f(GL.glGetUniformLocation(self.program, "ambient"), *ambient)
+        GL.glUniform3f(GL.glGetUniformLocation(self.program, "diffuse"), *diffuse)
+        GL.glUseProgram(0)
+
+    def draw(self, bodies, viewport_height, fov_y):
+        """
+        Draw the bodies with the current modelview / projection matrices
+        :param bodies: (n, 4) float32 [x, y, z, scale], contiguous
+        :param viewport_height: in pixels
+        :param fov_y: vertical field of view of the projection, in degrees
+        """
+        n = len(bodies)
+        if n == 0:
+            return
+
+        # upload (orphan the old storage if it is too small)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
+        if n > self.capacity:
+            self.capacity = n
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, n * _STRIDE, bodies, GL.GL_STREAM_DRAW)
+        else:
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, n * _STRIDE, bodies)
+
+        GL.glUseProgram(self.program)
+        GL.glUniform1f(self.u_point_scale, viewport_height / (2 * tan(radians(fov_y) / 2)))
+        GL.glEnable(GL.GL_VERTEX_PROGRAM_POINT_SIZE)
+        GL.glEnable(GL.GL_POINT_SPRITE)
+
+        GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glVertexPointer(4, GL.GL_FLOAT, _STRIDE, ctypes.c_void_p(0))
+        GL.glDrawArrays(GL.GL_POINTS, 0, n)
+        GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+
+        GL.glDisable(GL.GL_POINT_SPRITE)
+        GL.glDisable(GL.GL_VERTEX_PROGRAM_POINT_SIZE)
+        GL.glUseProgram(0)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
@@ -27,18 +27,20 @@
 
 # libs
 import cProfile
-import copy
 import io
 import pstats
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
 import numpy as np
-import lib.umsgpack as umsgpack
 
 # my libs
 from lib.helper import valueMap, time_ms, get_log_func
-from lib.planet_helper import load_planets, save_planets, calc_impulse, calc_initial_speed, calc_point_mass_for_planet
+from lib.frames import FrameSender, SharedFrames, SHM_AVAILABLE
+from lib.planet_helper import load_planets, save_planets, calc_impulse, calc_momentum, calc_momentum_drift, \
+    calc_energy, \
+    calc_initial_speed, calc_point_mass_for_planet
 from config import Config
 from planets import Planets
 from simulation_constants import END_MESSAGE
@@ -50,10 +52,14 @@ worker = None
 
 config = None
 
+# precision of pos, speeds and accels (config "precision")
+dtype = np.float64
+
 # debug options (GET SET VIA CONFIG)
 DEBUG_PLANETS = False
 DEBUG_FPS = False
 DEBUG_MOMENTUM = True
+DEBUG_ENERGY = False
 
 
 
@@ -77,7 +83,7 @@ def _initialise_planets(nr_of_planets: int):
 
     # load up planets from file if needed
     if mode == "last planet data":
-        pl, mode, success = load_planets(config.load_planets_file)
+        pl, mode, success = load_planets(config.load_planets_file, dtype)
         if not success:
             log("FATAL: could not load file", config.load_planets_file)
             log("File Error. Fallback to 'real' mode...")
@@ -94,7 +100,7 @@ def _initialise_planets(nr_of_planets: int):
     elif mode == "random":
 
         # planets obj
-        planets: Planets = Planets(nr_of_planets + 1)
+        planets: Planets = Planets(nr_of_planets + 1, dtype)
 
         # set blackhole
         planets.pos[0] = np.array((0, 0, 0), dtype=np.float64)
@@ -141,7 +147,7 @@ def _initialise_planets(nr_of_planets: int):
     elif mode == "real":
 
         # planets obj
-        planets: Planets = Planets(len(config.planets))
+        planets: Planets = Planets(len(config.planets), dtype)
 
         planets_in_config = config.planets_data
         for i, name_planet in enumerate(planets_in_config.items()):
@@ -188,20 +194,53 @@ def _initialise_planets(nr_of_planets: int):
 
 
 
-def startup(sim_pipe, sim_config: Config):
+def _move_planets(planets: Planets, delta_t, steps: int, dmaster: DistributedMaster = None):
+    """
+    Perform steps simulation steps, the update implementation writes into the back buffers
+    of planets, which become the current state (planets.swap())
+    :param planets:
+    :param delta_t:
+    :param steps:
+    :param dmaster: calculate on the cluster if set
+    :return:
+    """
+
+    # all steps in one call to the update implementation
+    if dmaster is None and hasattr(worker, "move_planets_n"):
+        t_pos, t_speeds, t_accels = planets.scratch() if steps > 1 else (None, None, None)
+        worker.move_planets_n(planets.pos, planets.speeds, planets.accels, planets.masses, planets.new_pos,
+                              planets.new_speeds, planets.new_accels, planets.n, delta_t, steps,
+                              t_pos, t_speeds, t_accels)
+        planets.swap()
+        return
+
+    # one call per step
+    for _ in range(steps):
+        if dmaster is not None:
+            dmaster.calculate_planets(planets, delta_t)
+        else:
+            worker.move_planets(planets.pos, planets.speeds, planets.accels, planets.masses, planets.new_pos,
+                                planets.new_speeds, planets.new_accels, planets.n, delta_t)
+        planets.swap()
+
+
+def startup(sim_pipe, sim_config: Config, frame_lock=None):
     """
     Initialise and continuously update a position list.
 
     Results are sent through a pipe after each update step
+    (or written into shared memory, see frame_transport in the config)
     :param sim_pipe:
     :param sim_config:
+    :param frame_lock: multiprocessing.Lock shared with the renderer, needed for frame_transport "shm"
     :return:
     """
 
     global config
     global worker
+    global dtype
     global chunks
-    global DEBUG_PLANETS, DEBUG_FPS, DEBUG_MOMENTUM, DEBUG_CLUSTER_TIMES, DEBUG_CLUSTER_RESULT
+    global DEBUG_PLANETS, DEBUG_FPS, DEBUG_MOMENTUM, DEBUG_ENERGY, DEBUG_CLUSTER_TIMES, DEBUG_CLUSTER_RESULT
 
     # assign config
     config = sim_config
@@ -211,6 +250,7 @@ def startup(sim_pipe, sim_config: Config):
     DEBUG_PLANETS = config.debug["planets"]
     DEBUG_FPS = config.debug["sim_fps"]
     DEBUG_MOMENTUM = config.debug["momentum"]
+    DEBUG_ENERGY = config.debug.get("energy", False)
 
     cluster_active = config.cluster["active"]
     dmaster: DistributedMaster = None
@@ -232,7 +272,27 @@ def startup(sim_pipe, sim_config: Config):
         except Exception:
             log(" !-_Error_-! importing update implementation", config.update_impl)
             log(f"     Falling back to fallback impl {config.update_impl_fallback}")
-            worker = import_module("native.worker_01")
+            try:
+                worker = import_module("native." + config.update_impl_fallback)
+            except Exception:
+                # pure numpy, always importable
+                log(" !-_Error_-! importing fallback impl, using worker_numpy")
+                worker = import_module("native.worker_numpy")
+
+        # pass implementation specific options (e.g. theta for barnes hut)
+        impl_options = getattr(config, "impl_options", {}).get(worker.__name__.split(".")[-1])
+        if impl_options and hasattr(worker, "configure"):
+            worker.configure(**impl_options)
+            log(f"      options: {impl_options}")
+
+    # single precision only if the update implementation supports it
+    precision = getattr(config, "precision", "float64")
+    if precision != "float64":
+        if cluster_active or precision not in getattr(worker, "PRECISIONS", ("float64",)):
+            log(f"precision {precision} not supported by the update implementation, using float64")
+            precision = "float64"
+    dtype = np.dtype(precision)
+    log(f"precision: {precision}")
 
     # init vars
     x_runner = 0
@@ -240,16 +300,37 @@ def startup(sim_pipe, sim_config: Config):
 
     # cache vars
     delta_t = sim_config.delta_t
+    steps_per_frame = max(1, int(getattr(sim_config, "steps_per_frame", 1)))
     print_every = sim_config.print_every
 
     # time that one simulation step should take
     # in ms
     max_step_ms = 1000 / sim_config.sim_fps
 
+    # binary frames to the renderer
+    frame_sender = FrameSender(sim_pipe)
+
     # load planets
     planets: Planets = _initialise_planets(int(config.nr_planets))
     log("Planets after initialization (startup(), _initialise_planets()): ", planets)
 
+    # frames through shared memory if possible, the pipe is the fallback
+    shared_frames = None
+    if getattr(config, "frame_transport", "pipe") == "shm":
+        if frame_lock is not None and SHM_AVAILABLE:
+            shared_frames = SharedFrames.create(planets.n, frame_lock)
+            frame_sender.send_shm(shared_frames.name, planets.n)
+            log(f"frames through shared memory {shared_frames.name}")
+        else:
+            log("frame_transport shm not available (needs python >= 3.8 and a frame_lock), using the pipe")
+    initial_momentum = calc_momentum(planets)
+
+    # the energy is O(n^2): calculated on a copy of the planets in a background thread
+    # (the native code releases the GIL), the result is logged when it is done
+    diagnostics = ThreadPoolExecutor(max_workers=1) if DEBUG_ENERGY else None
+    energy_future = diagnostics.submit(calc_energy, planets.__copy__()) if DEBUG_ENERGY else None
+    initial_energy = None
+
     while True:
 
         t1 = time_ms()
@@ -261,6 +342,11 @@ def startup(sim_pipe, sim_config: Config):
                     if cluster_active:
                         dmaster.cleanup(planets)
                         pass
+                    if shared_frames is not None:
+                        shared_frames.close()
+                        shared_frames.unlink()
+                    if diagnostics is not None:
+                        diagnostics.shutdown(wait=False)
                     log('exiting ...')
                     break
                 else:
@@ -269,6 +355,8 @@ def startup(sim_pipe, sim_config: Config):
                 if "chunks" in message:
                     # log(f"change chunks called: {message['chunks']}")
                     chunks = message['chunks']
+                    if dmaster is not None:
+                        dmaster.chunks = chunks
                 if "fps" in message:
                     log("change fps called: ", message["fps"])
                     max_step_ms = 1000 / message["fps"]
@@ -289,17 +377,6 @@ def startup(sim_pipe, sim_config: Config):
             # perform simulation step
             ###
 
-            new_planets: Planets = copy.deepcopy(planets)
-
-            # perform step (in-memory)
-            t_worker_start = time_ms()
-            if cluster_active:
-                dmaster.calculate_planets(planets, new_planets, delta_t)
-            else:
-                worker.move_planets(planets.pos, planets.speeds, planets.accels, planets.masses, new_planets.pos,
-                                    new_planets.speeds, new_planets.accels, planets.n, delta_t)
-            t_worker = time_ms() - t_worker_start
-
             # convert to a renderable format and send to the receiver
             # send to receiver process
             t_renderable_start = time_ms()
@@ -309,21 +386,37 @@ def startup(sim_pipe, sim_config: Config):
 
             # send to receiver (should be renderer)
             t_send_start = time_ms()
-            sim_pipe.send_bytes(umsgpack.packb(renderable))
+            if shared_frames is not None:
+                shared_frames.write(renderable)
+            else:
+                frame_sender.send_bodies(renderable)
             t_send = time_ms() - t_send_start
 
-            # update bodies
-            planets = new_planets
+            # perform steps_per_frame steps (in-memory)
+            # and update bodies (swap the buffers of planets)
+            t_worker_start = time_ms()
+            _move_planets(planets, delta_t, steps_per_frame, dmaster if cluster_active else None)
+            t_worker = time_ms() - t_worker_start
 
             # every <print_every> output some status
             if x_runner % print_every == 0:
                 if DEBUG_MOMENTUM:
                     # log(f"loop step: {time_ms() - t1}ms, {x_runner}x")
-                    log(f"momentum: {calc_impulse(planets):0.0f}")
+                    log(f"momentum: {calc_impulse(planets):0.0f}, "
+                        f"drift: {calc_momentum_drift(planets, initial_momentum):.3e}")
+                if DEBUG_ENERGY and energy_future is None:
+                    energy_future = diagnostics.submit(calc_energy, planets.__copy__())
                 if DEBUG_PLANETS:
                     log("planets:", planets)
             x_runner = x_runner + 1
 
+            if energy_future is not None and energy_future.done():
+                energy = energy_future.result()
+                if initial_energy is None:
+                    initial_energy = energy
+                log(f"energy: {energy:.6e}, drift: {abs(energy - initial_energy) / abs(initial_energy):.3e}")
+                energy_future = None
+
             # wait for fps if necessary
             t = time_ms() - t1
             if t < max_step_ms:
@@ -341,11 +434,11 @@ def startup(sim_pipe, sim_config: Config):
             time.sleep(0.05)
 
 
-def startup_profile(sim_pipe, sim_config: Config):
+def startup_profile(sim_pipe, sim_config: Config, frame_lock=None):
     pr = cProfile.Profile()
     pr.enable()
 
-    startup(sim_pipe, sim_config)
+    startup(sim_pipe, sim_config, frame_lock)
 
     pr.disable()
     s = io.StringIO
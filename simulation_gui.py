@@ -23,7 +23,6 @@
 import multiprocessing
 import sys
 import numpy as np
-import lib.umsgpack as umsgpack
 
 from PyQt5 import QtWidgets, uic
 
@@ -31,6 +30,7 @@ import galaxy_renderer
 import simulation as simulation
 from config import Config
 from lib.helper import get_log_func
+from lib.frames import send_end
 from simulation_constants import END_MESSAGE
 
 CONFIG_FILE = "save.cfg.json"
@@ -201,18 +201,23 @@ class SimulationGUI(QtWidgets.QWidget):
 
         # create a pipe which solely purpose is to send commands to the simulation
         self.renderer_conn, self.simulation_conn = multiprocessing.Pipe()
+
+        # guards the shared memory frames (frame_transport "shm")
+        frame_lock = multiprocessing.Lock()
         if self.config.profile:
             self.simulation_process = \
                 multiprocessing.Process(target=simulation.startup_profile,
-                                        args=(self.simulation_conn, self.config))
+                                        args=(self.simulation_conn, self.config, frame_lock))
         else:
             self.simulation_process = \
                 multiprocessing.Process(target=simulation.startup,
-                                        args=(self.simulation_conn, self.config))
+                                        args=(self.simulation_conn, self.config, frame_lock))
 
         self.render_process = \
             multiprocessing.Process(target=galaxy_renderer.startup,
-                                    args=(self.renderer_conn, self.config.render_fps), )
+                                    args=(self.renderer_conn, self.config.render_fps, frame_lock,
+                                          getattr(self.config, "render_path", "sprites"),
+                                          getattr(self.config, "interpolate", True)), )
         self.simulation_process.start()
         self.render_process.start()
         self.paused = True
@@ -235,11 +240,11 @@ class SimulationGUI(QtWidgets.QWidget):
 
     def stop_simulation(self):
         """
-            Stop simulation and render process by sending END_MESSAGE
+            Stop simulation and render process by sending END_MESSAGE / an end frame
             through the pipes.
         """
         if self.simulation_process is not None:
-            self.simulation_conn.send_bytes(umsgpack.packb(END_MESSAGE))
+            send_end(self.simulation_conn)
             self.simulation_process = None
 
         if self.render_process is not None:
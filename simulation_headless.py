@@ -1,43 +1,88 @@
+"""
+Run the simulation without GUI / renderer
+
+Measures steps per second (and frames / bytes per second of the frame
+transport), optionally exports the frames as images and can sweep over
+parameters, e.g.:
+
+    python3 simulation_headless.py --impl cyworker_tiled -n 5000 --seconds 60
+    python3 simulation_headless.py --sweep n=1000,5000,20000 --sweep impl=all \\
+        --steps 200 --csv sweep.csv
+    python3 simulation_headless.py --impl cluster --chunks 8 \\
+        --manager-host xray.informatik.fh-augsburg.de --redis-host xray.informatik.fh-augsburg.de
+"""
+
+import argparse
+import csv
+import itertools
 import multiprocessing
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
 
 from config import Config
 from simulation_constants import END_MESSAGE
 from lib.helper import get_log_func
+from lib.frames import FrameReceiver, FRAME_BODIES
+from frame_export import FrameExporter, FORMATS
 import simulation
 
 log = get_log_func("[headless]")
-SECONDS_TO_RUN = 120
 
-# specify the mode in which the simulation is run
-# to alter cluster values open appropriate json files or the GUI
-MODE = 'cluster' # or '<worker_implementation>'
+# parameters a sweep can vary, with their type
+SWEEP_KEYS = {
+    "impl": str,
+    "n": int,
+    "chunks": int,
+    "steps_per_frame": int,
+}
 
+CSV_FIELDS = ["impl", "n", "chunks", "steps_per_frame", "seconds", "frames", "steps",
+              "steps_per_s", "frames_per_s", "mib_per_s", "status"]
 
-def main():
 
+def run(params: dict) -> dict:
+    """
+    One headless run
+    :param params: the parsed command line arguments (as dict)
+    :return: one row of results (CSV_FIELDS)
+    """
     # load config
-    # make sure to configure it before using
-    config = Config(filename="save.cfg.json")
+    config = Config(filename=params["config"])
     config.load()
-    if MODE == 'cluster':
-        config.cluster["active"] = True
-        config.cluster["manager_host"] = "xray.informatik.fh-augsburg.de"
-        config.cluster["manager_port"] = 33333
-        config.cluster["redis_host"] = "xray.informatik.fh-augsburg.de"
-        config.cluster["redis_port"] = 6379
-        config.cluster["chunks"] = 8
-    elif MODE in config.update_impls:
-        config.update_impl = MODE
+
+    if params["impl"] is None:
+        params = dict(params, impl=config.update_impl)
+    config.cluster["active"] = params["impl"] == "cluster"
+    if config.cluster["active"]:
+        for key in ("manager_host", "manager_port", "redis_host", "redis_port"):
+            if params[key] is not None:
+                config.cluster[key] = params[key]
+    elif params["impl"] in config.update_impls:
+        config.update_impl = params["impl"]
     else:
-        log(f"no MODE '{MODE}'")
+        raise ValueError(f"unknown impl '{params['impl']}', use 'cluster' or one of {config.update_impls}")
+    if params["chunks"] is not None:
+        config.cluster["chunks"] = params["chunks"]
 
+    config.mode_stuff["mode"] = params["mode"]
+    config.nr_planets = params["n"]
+    if params["steps_per_frame"] is not None:
+        config.steps_per_frame = params["steps_per_frame"]
+    steps_per_frame = max(1, int(getattr(config, "steps_per_frame", 1)))
 
-    # random planets
-    config.mode_stuff["mode"] = 1
+    # as fast as possible
+    if params["sim_fps"] is not None:
+        config.sim_fps = params["sim_fps"]
 
-    # 5000
-    config.nr_planets = 5000
+    row = {
+        "impl": params["impl"],
+        "n": params["n"],
+        "chunks": config.cluster["chunks"] if config.cluster["active"] else "",
+        "steps_per_frame": steps_per_frame,
+    }
+    log(f"run {row}")
 
     # load up simulation
     # create a pipe which solely purpose is to send commands to the simulation
@@ -47,14 +92,214 @@ def main():
                                 args=(simulation_conn, config))
     simulation_process.start()
 
-    # spin around and don't use the results
-    t = time.time()
-    while time.time() - t < SECONDS_TO_RUN:
-        if renderer_conn.poll():
-            renderer_conn.recv_bytes()
+    # frames are encoded on a thread pool, the loop never waits for them
+    receiver = FrameReceiver(renderer_conn)
+    exporter = None
+    if params["export_dir"] is not None:
+        exporter = FrameExporter(params["export_dir"], params["export_size"],
+                                 params["export_format"], params["export_workers"])
+
+    # the clock starts with the first frame (planet generation is not measured),
+    # steps/s are measured with the timestamps of the frames (sent after each
+    # steps_per_frame steps), so frames waiting in the pipe do not count
+    t = None
+    t_report = None
+    start = last_report = (0, 0)
+    first_timestamp = last_timestamp = 0.0
+    frames = 0
+    max_frames = None
+    if params["steps"] is not None:
+        max_frames = (params["steps"] + steps_per_frame - 1) // steps_per_frame
+    status = "ok"
+
+    # block until frames arrive (no busy polling, the core is left to the simulation),
+    # drain the pipe and export the frames if wanted
+    while True:
+        now = time.time()
+        if t is not None:
+            if max_frames is not None and frames >= max_frames:
+                break
+            if now - t >= params["seconds"]:
+                if max_frames is not None:
+                    status = "timeout"
+                break
+            if now - t_report >= params["report_every"]:
+                _report(receiver, now - t_report, last_report)
+                last_report = (receiver.frames_received, receiver.bytes_received)
+                t_report = now
+
+        if not simulation_process.is_alive():
+            status = "crashed"
+            break
+
+        timeout = 1.0 if t is None else min(t + params["seconds"], t_report + params["report_every"]) - now
+        if wait([renderer_conn], max(timeout, 0)):
+            # up to the next deadline, a simulation that keeps sending
+            # must not starve the time limit and the reports above
+            while renderer_conn.poll() and (max_frames is None or frames < max_frames) and \
+                    (t is None or time.time() < min(t + params["seconds"], t_report + params["report_every"])):
+                kind, timestamp, bodies = receiver.recv()
+                if kind != FRAME_BODIES:
+                    continue
+                if t is None:
+                    t = t_report = time.time()
+                    first_timestamp = timestamp
+                    # count from here
+                    start = last_report = (receiver.frames_received, receiver.bytes_received)
+                else:
+                    frames += 1
+                last_timestamp = timestamp
+                if exporter is not None:
+                    exporter.submit(bodies)
 
     renderer_conn.send(END_MESSAGE)
-    time.sleep(0.1)
+    if t is not None:
+        _report(receiver, time.time() - t, start)
+    if exporter is not None:
+        exporter.close()
+    simulation_process.join(5)
+    if simulation_process.is_alive():
+        simulation_process.terminate()
+
+    # frames after the first one: one frame per steps_per_frame steps
+    seconds = last_timestamp - first_timestamp
+    row.update({
+        "seconds": round(seconds, 3),
+        "frames": frames,
+        "steps": frames * steps_per_frame,
+        "steps_per_s": round(frames * steps_per_frame / seconds, 3) if seconds > 0 else 0.0,
+        "frames_per_s": round(frames / seconds, 3) if seconds > 0 else 0.0,
+        "mib_per_s": round((receiver.bytes_received - start[1]) / (1 << 20) / seconds, 3) if seconds > 0 else 0.0,
+        "status": status,
+    })
+    log(f"result {row}")
+    return row
+
+
+def _run_or_fail(params: dict) -> dict:
+    """
+    run(), a failing run is a row with the error as status (the sweep goes on)
+    """
+    try:
+        return run(params)
+    except Exception as e:
+        log(f"run failed: {e}")
+        return {"impl": params["impl"], "n": params["n"], "chunks": params["chunks"] or "",
+                "steps_per_frame": params["steps_per_frame"] or "", "seconds": 0.0, "frames": 0,
+                "steps": 0, "steps_per_s": 0.0, "frames_per_s": 0.0, "mib_per_s": 0.0,
+                "status": f"error: {e}"}
+
+
+def _report(receiver, seconds, since=(0, 0)):
+    """
+    log frames / bytes per second received since the counters were at since
+    """
+    frames = receiver.frames_received - since[0]
+    mbytes = (receiver.bytes_received - since[1]) / (1 << 20)
+    log(f"{frames} frames in {seconds:.1f}s: {frames / seconds:.1f} frames/s, {mbytes / seconds:.2f} MiB/s")
+
+
+def _parse_sweep(specs, update_impls):
+    """
+    ["n=1000,5000", "impl=all"] -> {"n": [1000, 5000], "impl": [...update_impls]}
+    """
+    sweep = {}
+    for spec in specs:
+        key, _, values = spec.partition("=")
+        key = key.strip().replace("-", "_")
+        if key not in SWEEP_KEYS or not values:
+            raise ValueError(f"bad sweep '{spec}', use <key>=<v1>,<v2>,... with key in {list(SWEEP_KEYS)}")
+        if key == "impl" and values == "all":
+            sweep[key] = list(update_impls)
+        else:
+            sweep[key] = [SWEEP_KEYS[key](_parse_count(v) if SWEEP_KEYS[key] is int else v)
+                          for v in values.split(",")]
+    return sweep
+
+
+def _parse_count(value):
+    """
+    "5k" -> 5000
+    """
+    value = value.strip().lower()
+    if value.endswith("k"):
+        return int(float(value[:-1]) * 1000)
+    return int(value)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the simulation without GUI and measure steps/s")
+    parser.add_argument("--config", default="save.cfg.json", help="config file (default: %(default)s)")
+    parser.add_argument("--impl",
+                        help="update implementation (update_impls in the config) or 'cluster' "
+                             "(default: update_impl of the config)")
+    parser.add_argument("-n", type=_parse_count, default=5000, help="number of planets (random mode)")
+    parser.add_argument("--mode", type=int, default=1, help="index into mode_stuff.modes (default: 1, random)")
+    parser.add_argument("--seconds", type=float, default=120, help="duration (or timeout with --steps)")
+    parser.add_argument("--steps", type=int, help="stop after this many simulation steps")
+    parser.add_argument("--steps-per-frame", type=int, help="steps per frame (default: from the config)")
+    parser.add_argument("--sim-fps", type=float, default=float("inf"),
+                        help="frame rate limit of the simulation (default: unlimited)")
+    parser.add_argument("--report-every", type=float, default=10, help="log throughput every x seconds")
+
+    cluster = parser.add_argument_group("cluster (--impl cluster)")
+    cluster.add_argument("--chunks", type=int)
+    cluster.add_argument("--manager-host")
+    cluster.add_argument("--manager-port", type=int)
+    cluster.add_argument("--redis-host")
+    cluster.add_argument("--redis-port", type=int)
+
+    export = parser.add_argument_group("frame export")
+    export.add_argument("--export-dir", help="write the frames as numbered images into this directory")
+    export.add_argument("--export-format", choices=FORMATS, default="png")
+    export.add_argument("--export-size", type=int, nargs=2, default=(512, 512), metavar=("W", "H"))
+    export.add_argument("--export-workers", type=int, default=2)
+
+    sweep = parser.add_argument_group("sweeps")
+    sweep.add_argument("--sweep", action="append", default=[], metavar="KEY=V1,V2",
+                       help=f"run all combinations, key in {list(SWEEP_KEYS)}, impl=all for all update_impls")
+    sweep.add_argument("--jobs", type=int, default=1,
+                       help="runs in parallel (they compete for the cores, default: %(default)s)")
+    sweep.add_argument("--csv", help="write one row of results per run into this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = vars(args)
+
+    config = Config(filename=args.config)
+    config.load()
+    sweep = _parse_sweep(args.sweep, config.update_impls)
+
+    # one run per combination of the swept values
+    runs = []
+    for values in itertools.product(*sweep.values()):
+        p = dict(params)
+        p.update(zip(sweep.keys(), values))
+        if p["export_dir"] is not None and len(sweep) > 0:
+            p["export_dir"] = f"{args.export_dir}/{'_'.join(f'{k}{v}' for k, v in zip(sweep.keys(), values))}"
+        runs.append(p)
+
+    # every run starts its own simulation process and mostly waits on its pipe,
+    # so threads are enough (and may start processes, unlike daemonic pool workers)
+    if args.jobs > 1 and len(runs) > 1:
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            rows = list(pool.map(_run_or_fail, runs))
+    else:
+        rows = [_run_or_fail(p) for p in runs]
+
+    if args.csv is not None:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        log(f"results written to {args.csv}")
+
+    for row in rows:
+        log(f"{str(row['impl']):20s} n={row['n']:<7} {row['steps_per_s']:10.2f} steps/s  {row['status']}")
+    return 0 if all(row["status"] == "ok" for row in rows) else 1
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())